@@ -0,0 +1,198 @@
+import base64
+import functools
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Sessions are cached per user and connection settings, readable only by the owner
+SESSION_CACHE_PATH = os.path.join(
+    os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")),
+    "terraformer",
+    "sessions.json",
+)
+# don't hand out a session that's about to expire
+EXPIRY_MARGIN_SECONDS = 300
+# key-pair JWTs for the SQL API are valid for at most an hour
+JWT_LIFETIME_SECONDS = 3600
+
+
+def auth_kwargs() -> Dict:
+    """
+    the snowflake.connector.connect arguments for the first authentication method
+    found in the environment:
+        SNOWFLAKE_PRIVATE_KEY_PATH (+ SNOWFLAKE_PRIVATE_KEY_PASSPHRASE): key-pair
+        SNOWFLAKE_OAUTH_TOKEN: OAuth access token
+        SNOWFLAKE_AUTHENTICATOR: e.g. externalbrowser, the connector caches the
+            SSO ID token across runs
+        SNOWFLAKE_PASSWORD: username / password
+    """
+    if not os.environ.get("SNOWFLAKE_USER"):
+        raise OSError("Missing env var: SNOWFLAKE_USER")
+    kwargs = {"user": os.environ["SNOWFLAKE_USER"]}
+    if os.environ.get("SNOWFLAKE_PRIVATE_KEY_PATH"):
+        kwargs["private_key"] = load_private_key(
+            os.environ["SNOWFLAKE_PRIVATE_KEY_PATH"],
+            os.environ.get("SNOWFLAKE_PRIVATE_KEY_PASSPHRASE"),
+        )
+    elif os.environ.get("SNOWFLAKE_OAUTH_TOKEN"):
+        kwargs["authenticator"] = "oauth"
+        kwargs["token"] = os.environ["SNOWFLAKE_OAUTH_TOKEN"]
+    elif os.environ.get("SNOWFLAKE_AUTHENTICATOR"):
+        kwargs["authenticator"] = os.environ["SNOWFLAKE_AUTHENTICATOR"]
+        kwargs["client_store_temporary_credential"] = True
+    elif os.environ.get("SNOWFLAKE_PASSWORD"):
+        kwargs["password"] = os.environ["SNOWFLAKE_PASSWORD"]
+    else:
+        raise OSError(
+            "Missing env vars: one of SNOWFLAKE_PRIVATE_KEY_PATH, SNOWFLAKE_OAUTH_TOKEN,"
+            " SNOWFLAKE_AUTHENTICATOR or SNOWFLAKE_PASSWORD"
+        )
+    return kwargs
+
+
+def read_private_key(path: str, passphrase: Optional[str] = None):
+    from cryptography.hazmat.backends import default_backend
+    from cryptography.hazmat.primitives import serialization
+
+    # e.g. "~/.ssh/sandbox.p8" in the `env` of an --accounts config
+    with open(os.path.expanduser(path), "rb") as f:
+        return serialization.load_pem_private_key(
+            f.read(),
+            password=passphrase.encode() if passphrase else None,
+            backend=default_backend(),
+        )
+
+
+@functools.lru_cache(maxsize=None)
+def load_private_key(path: str, passphrase: Optional[str] = None) -> bytes:
+    # the connector wants the key as unencrypted DER bytes. Decrypted once per
+    #   process, every connection asks for it
+    from cryptography.hazmat.primitives import serialization
+
+    key = read_private_key(path, passphrase)
+    return key.private_bytes(
+        encoding=serialization.Encoding.DER,
+        format=serialization.PrivateFormat.PKCS8,
+        encryption_algorithm=serialization.NoEncryption(),
+    )
+
+
+def b64url(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+def keypair_jwt(
+    account: str,
+    user: str,
+    path: str,
+    passphrase: Optional[str] = None,
+    lifetime: int = JWT_LIFETIME_SECONDS,
+) -> str:
+    """
+    a JWT for key-pair authentication to the SQL API (see rest_transport.py), signed
+    with the user's private key and naming the fingerprint of its public key
+    """
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import padding
+
+    key = read_private_key(path, passphrase)
+    public_key = key.public_key().public_bytes(
+        encoding=serialization.Encoding.DER,
+        format=serialization.PublicFormat.SubjectPublicKeyInfo,
+    )
+    fingerprint = base64.b64encode(hashlib.sha256(public_key).digest()).decode()
+    # the account locator without its region, e.g. XY12345 for xy12345.us-east-1
+    qualified_user = f"{account.split('.')[0].upper()}.{user.upper()}"
+    now = int(time.time())
+    header = {"alg": "RS256", "typ": "JWT"}
+    payload = {
+        "iss": f"{qualified_user}.SHA256:{fingerprint}",
+        "sub": qualified_user,
+        "iat": now,
+        "exp": now + lifetime,
+    }
+    signing_input = ".".join(
+        b64url(json.dumps(part).encode()) for part in [header, payload]
+    )
+    signature = key.sign(signing_input.encode(), padding.PKCS1v15(), hashes.SHA256())
+    return f"{signing_input}.{b64url(signature)}"
+
+
+class SessionCache:
+    """
+    A local cache of session and master tokens, shared by every process of the
+    same user. A connection opened with cached tokens skips the login round trip;
+    the connector renews the session token with the master token until the master
+    token expires. Sessions are kept alive on close so the tokens stay valid.
+    """
+
+    def __init__(self, path: str = SESSION_CACHE_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        # one login at a time per key, see login_lock
+        self.login_locks: Dict[str, threading.Lock] = {}
+
+    def _read(self) -> Dict[str, dict]:
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write(self, sessions: Dict[str, dict]) -> None:
+        directory = os.path.dirname(self.path)
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        # written to a 0600 temp file first, so other processes never see half a file
+        fd, tmp_path = tempfile.mkstemp(dir=directory)
+        with os.fdopen(fd, "w") as f:
+            json.dump(sessions, f)
+        os.replace(tmp_path, self.path)
+
+    def get(self, key: str) -> Optional[dict]:
+        with self.lock:
+            session = self._read().get(key)
+        if session and session["expires_at"] > time.time() + EXPIRY_MARGIN_SECONDS:
+            # only the tokens, as snowflake.connector.connect arguments
+            return {k: v for k, v in session.items() if k != "expires_at"}
+        return None
+
+    def login_lock(self, key: str) -> threading.Lock:
+        # held while logging in after a cache miss, so threads missing at the same
+        #   time wait for the first login instead of each opening a session
+        with self.lock:
+            return self.login_locks.setdefault(key, threading.Lock())
+
+    def put(self, key: str, con) -> bool:
+        """
+        caches the session of `con`. Returns False, leaving the cache as it is, when
+        another process cached a session that's still valid in the meantime
+        """
+        session = {
+            "session_token": con.rest.token,
+            "master_token": con.rest.master_token,
+            "master_validity_in_seconds": con.rest.master_validity_in_seconds,
+            "expires_at": time.time() + con.rest.master_validity_in_seconds,
+        }
+        with self.lock:
+            sessions = self._read()
+            now = time.time()
+            sessions = {k: v for k, v in sessions.items() if v["expires_at"] > now}
+            cached = sessions.get(key)
+            if cached and cached["expires_at"] > now + EXPIRY_MARGIN_SECONDS:
+                return False
+            sessions[key] = session
+            self._write(sessions)
+        return True
+
+    def drop(self, key: str) -> None:
+        with self.lock:
+            sessions = self._read()
+            if sessions.pop(key, None) is not None:
+                self._write(sessions)
@@ -0,0 +1,67 @@
+"""
+Guards the start-up time of the CLI: fails when `terraformer.py --help` gets slower
+than the budget, or when importing the entry point loads a heavy dependency.
+Run it with `make bench-import-time`.
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+THIS_DIR = os.path.dirname(os.path.realpath(__file__))
+
+# these are only allowed to load in the code paths that talk to Snowflake
+HEAVY_MODULES = ["snowflake.connector", "pandas", "pyarrow", "sqlalchemy"]
+
+CHECK_IMPORTS = f"""
+import sys
+import terraformer
+loaded = [m for m in {HEAVY_MODULES!r} if m in sys.modules]
+print(",".join(loaded))
+"""
+
+
+def time_help(runs):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable, os.path.join(THIS_DIR, "terraformer.py"), "--help"],
+            check=True,
+            stdout=subprocess.DEVNULL,
+        )
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def heavy_imports():
+    result = subprocess.run(
+        [sys.executable, "-c", CHECK_IMPORTS],
+        cwd=THIS_DIR,
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    return [m for m in result.stdout.strip().split(",") if m]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument(
+        "--budget", type=float, default=0.5, help="max median seconds for --help"
+    )
+    args = parser.parse_args()
+
+    loaded = heavy_imports()
+    median = time_help(args.runs)
+    print(
+        f"terraformer.py --help: {median * 1000:.0f}ms (budget {args.budget * 1000:.0f}ms)"
+    )
+    if loaded:
+        sys.exit(f"Importing terraformer.py loaded heavy modules: {', '.join(loaded)}")
+    if median > args.budget:
+        sys.exit("terraformer.py --help is over its start-up budget")
@@ -1,19 +1,39 @@
 import logging
 import os
+import random
+import re
 import sys
+import threading
+import time
 import getpass
 
-import pandas as pd  # for type hints
-import snowflake.connector
-import snowflake.connector.errors
-import sqlalchemy
 import json
+import profiler
+from auth import SessionCache, auth_kwargs
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import closing, contextmanager
-from typing import Iterator, List, Tuple
+from typing import (
+    TYPE_CHECKING,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    TypeVar,
+)
+
+# snowflake.connector and pandas take seconds to import, so they are imported in
+#   the functions that use them. A `--help` or an offline render never loads them.
+if TYPE_CHECKING:
+    import pandas as pd
+    import snowflake.connector
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
 
+T = TypeVar("T")
+
 # Snowflake login credentials
 ACCOUNT = "YOUR_ACCOUNT"
 WAREHOUSE = "YOUR_WAREHOUSE"
@@ -21,8 +41,78 @@ DATABASE = "YOUR_DATABASE"
 ROLE = "YOUR_ROLE"
 SCHEMA = "PUBLIC"
 
+CLIENT_SETTINGS = ["ACCOUNT", "WAREHOUSE", "DATABASE", "ROLE", "SCHEMA", "TRANSPORT"]
+
+
+def configure(**settings) -> None:
+    """
+    overrides the login settings above (account, warehouse, database, role, schema)
+    or the TRANSPORT, e.g. in the worker process that scrapes one of several accounts
+    """
+    for setting, value in settings.items():
+        if setting.upper() not in CLIENT_SETTINGS:
+            raise ValueError(f"Unknown client setting: {setting}")
+        globals()[setting.upper()] = value
+
+
+# When True, connections are opened without a warehouse and only statements that
+#   run in the cloud-services layer (SHOW, DESC, ...) are allowed, so a scrape
+#   never resumes a suspended warehouse.
+METADATA_ONLY = False
+METADATA_KEYWORDS = ("show", "desc", "describe", "use")
+
+# Reuse logged-in sessions across connections, processes and runs until they expire.
+#   Set SNOWFLAKE_SESSION_CACHE=0 to log in on every connection.
+session_cache = SessionCache()
+
+# SHOW commands return a capped number of rows, iter_show pages through them
+SHOW_PAGE_SIZE = 10000
+
+# "connector" runs exec_sql/exec_sql_multi through snowflake.connector sessions,
+#   "rest" through the SQL API over keep-alive HTTP, see rest_transport.py.
+#   None falls back to SNOWFLAKE_TRANSPORT, or "connector".
+TRANSPORT: Optional[str] = None
+
+# Statements in flight are limited adaptively, see AdaptiveLimiter
+CONCURRENCY_INITIAL = 4
+CONCURRENCY_MAX = 32
+# the limit is multiplied by this on throttling or a latency spike
+BACKOFF_FACTOR = 0.5
+# a statement this many times slower than the average of its kind is a latency spike
+LATENCY_TOLERANCE = 3.0
+# weight of the latest latency in the moving average of its kind of statement
+LATENCY_ALPHA = 0.2
+
+# Transient errors (network, HTTP 5xx/429, throttling) are retried with
+#   exponential backoff and full jitter, so retries of concurrent statements spread out
+MAX_RETRIES = 5
+RETRY_BASE_SECONDS = 0.5
+RETRY_MAX_SECONDS = 30.0
+TRANSIENT_ERRORS = [
+    "OperationalError",
+    "InterfaceError",
+    "ServiceUnavailableError",
+    "GatewayTimeoutError",
+    "InternalServerError",
+    "BadGatewayError",
+    "OtherHTTPRetryableError",
+    "RequestTimeoutError",
+    "TooManyRequests",
+]
+# the errors that mean Snowflake is overloaded or throttling us
+THROTTLING_ERRORS = [
+    "ServiceUnavailableError",
+    "GatewayTimeoutError",
+    "RequestTimeoutError",
+    "TooManyRequests",
+]
+
+# Every statement that needed (or, in METADATA_ONLY mode, would have needed) a
+#   running warehouse. Used to report compute usage at the end of a run.
+compute_statements: List[str] = []
+
+# "user" is added from SNOWFLAKE_USER when a statement runs, see query_tag
 QUERY_TAGS = {
-    "user": os.environ.get("SNOWFLAKE_USER"),
     "unix_user": getpass.getuser(),  # useful backup
     "entrypoint": f"{sys.argv[0]}"
     if sys.argv[0].endswith(".py")
@@ -31,56 +121,280 @@ QUERY_TAGS = {
 }
 
 
+# The env vars are read on every statement rather than at import, so they can be
+#   set per account in the `env` of --accounts
+def use_session_cache() -> bool:
+    return os.environ.get("SNOWFLAKE_SESSION_CACHE", "1") != "0"
+
+
+def transport() -> str:
+    return TRANSPORT or os.environ.get("SNOWFLAKE_TRANSPORT", "connector")
+
+
+def query_tag() -> str:
+    return json.dumps({"user": os.environ.get("SNOWFLAKE_USER"), **QUERY_TAGS})
+
+
+class WarehouseRequiredError(Exception):
+    """Raised in METADATA_ONLY mode for a statement that needs a warehouse."""
+
+
+def needs_warehouse(sql: str) -> bool:
+    # Only metadata commands are served by the cloud-services layer, anything
+    #   else (e.g. selecting from information_schema) needs a running warehouse
+    statements = [stmt.strip() for stmt in sql.split(";") if stmt.strip()]
+    return any(
+        stmt.split(None, 1)[0].lower() not in METADATA_KEYWORDS for stmt in statements
+    )
+
+
+def check_compute(sql: str) -> None:
+    if not needs_warehouse(sql):
+        return
+    compute_statements.append(sql)
+    if METADATA_ONLY:
+        logger.warning(f"Skipping statement that needs a warehouse:\n{sql}")
+        raise WarehouseRequiredError(sql)
+
+
+def error_types(names: List[str]) -> Tuple[type, ...]:
+    import snowflake.connector.errors
+
+    # TooManyRequests only exists in recent connector versions
+    return tuple(
+        getattr(snowflake.connector.errors, name)
+        for name in names
+        if hasattr(snowflake.connector.errors, name)
+    )
+
+
+def statement_kind(sql: str) -> Optional[str]:
+    # e.g. "show schemas" or "desc stage", latencies are compared per kind. Bulk
+    #   scans (selects, SHOW ... IN DATABASE) take as long as the database is big,
+    #   so their latency says nothing about load and they have no kind.
+    words = sql.lower().split()
+    if not words or words[0] not in METADATA_KEYWORDS:
+        return None
+    if re.search(r"\bin\s+database\b", sql, flags=re.IGNORECASE):
+        return None
+    return " ".join(words[:2])
+
+
+class AdaptiveLimiter:
+    """
+    Limits the number of statements in flight, adjusting the limit like TCP
+    congestion control (AIMD): while it is in use, it grows by one for every
+    `limit` statements that finish at a normal latency, and is multiplied by
+    BACKOFF_FACTOR when Snowflake throttles or a statement is LATENCY_TOLERANCE
+    times slower than usual for its kind (bulk scans aren't compared). Only
+    statements started after the last cut can cut it again, so a burst of slow
+    statements counts as one signal.
+    """
+
+    def __init__(
+        self, initial: int = CONCURRENCY_INITIAL, maximum: int = CONCURRENCY_MAX
+    ):
+        self.limit = float(min(initial, maximum))
+        self.maximum = maximum
+        self.in_flight = 0
+        self.condition = threading.Condition()
+        self.latencies: Dict[str, float] = {}
+        self.last_cut = 0.0
+
+    @contextmanager
+    def slot(self, sql: str) -> Iterator[None]:
+        with self.condition:
+            self.condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+        start = time.monotonic()
+        try:
+            yield
+        except error_types(THROTTLING_ERRORS) as e:
+            self.cut(start, f"throttled: {e!r}")
+            raise
+        else:
+            kind = statement_kind(sql)
+            if kind is not None:
+                self.observe(kind, start, time.monotonic() - start)
+        finally:
+            with self.condition:
+                self.in_flight -= 1
+                self.condition.notify_all()
+
+    def observe(self, kind: str, start: float, latency: float) -> None:
+        with self.condition:
+            average = self.latencies.get(kind, latency)
+            self.latencies[kind] = average + LATENCY_ALPHA * (latency - average)
+            if latency <= LATENCY_TOLERANCE * average:
+                # only grow a limit that is in use, idle slots say nothing about load
+                if self.in_flight >= int(self.limit):
+                    self.limit = min(self.maximum, self.limit + 1 / self.limit)
+                    self.condition.notify_all()
+                return
+        self.cut(start, f"{kind} took {latency:.1f}s, usually {average:.1f}s")
+
+    def cut(self, start: float, reason: str) -> None:
+        with self.condition:
+            if start < self.last_cut:
+                return
+            self.last_cut = time.monotonic()
+            self.limit = max(1.0, self.limit * BACKOFF_FACTOR)
+        logger.info(f"Cut the concurrency limit to {int(self.limit)}, {reason}")
+
+
+limiter = AdaptiveLimiter()
+
+
+def run_statement(sql: str, execute: Callable[[], T]) -> T:
+    """
+    calls `execute` (which runs `sql`) in a limiter slot, and calls it again on a
+    transient error after a jittered exponential backoff
+    """
+    for attempt in range(MAX_RETRIES):
+        try:
+            with limiter.slot(sql):
+                return execute()
+        except error_types(TRANSIENT_ERRORS) as e:
+            backoff = min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * 2**attempt)
+            delay = random.uniform(0, backoff)
+            logger.warning(f"Retrying in {delay:.1f}s after {e!r}:\n{sql}")
+            time.sleep(delay)
+    with limiter.slot(sql):
+        return execute()
+
+
 @contextmanager
 def get_snowflake_connection(
     **kwargs,
-) -> Iterator[snowflake.connector.SnowflakeConnection]:
-    if not (os.environ.get("SNOWFLAKE_USER") and os.environ.get("SNOWFLAKE_PASSWORD")):
-        raise OSError("Missing env vars: SNOWFLAKE_USER and/or SNOWFLAKE_PASSWORD")
+) -> Iterator["snowflake.connector.SnowflakeConnection"]:
+    import snowflake.connector
+    import snowflake.connector.errors
 
-    # Note that the connection is opened with autocommit set to True
-    con = snowflake.connector.connect(
+    if not METADATA_ONLY:
+        # metadata-only connections don't bind a warehouse, so nothing can resume it
+        kwargs.setdefault("warehouse", WAREHOUSE)
+
+    connect_kwargs = dict(
         account=ACCOUNT,
-        user=os.environ.get("SNOWFLAKE_USER"),
-        password=os.environ.get("SNOWFLAKE_PASSWORD"),
         database=DATABASE,
         schema=SCHEMA,
-        warehouse=WAREHOUSE,
         role=ROLE,
-        session_parameters={"QUERY_TAG": f"{json.dumps(QUERY_TAGS)}"},
+        session_parameters={"QUERY_TAG": query_tag()},
+        **auth_kwargs(),
         **kwargs,
     )
+    # a cached session is only valid for the same user and connection settings
+    session_key = "|".join(
+        str(connect_kwargs.get(k))
+        for k in [
+            "account",
+            "user",
+            "role",
+            "warehouse",
+            "database",
+            "schema",
+            "autocommit",
+        ]
+    )
+    # Only autocommit sessions are cached and shared. A transaction (e.g.
+    #   exec_sql_multi, autocommit=False) gets a session of its own that is logged
+    #   out on close, so no other connection can commit it or inherit its state
+    use_cache = use_session_cache() and kwargs.get("autocommit") is True
+
+    def open_cached_session() -> Optional["snowflake.connector.SnowflakeConnection"]:
+        session = session_cache.get(session_key)
+        if not session:
+            return None
+        try:
+            return snowflake.connector.connect(
+                server_session_keep_alive=True, **connect_kwargs, **session
+            )
+        except snowflake.connector.errors.ProgrammingError:
+            logger.info("Cached Snowflake session is no longer valid, logging in")
+            session_cache.drop(session_key)
+            return None
+
+    # Note that the connection is opened with autocommit set to True
+    # a kept-alive session that didn't make it into the cache is logged out on close
+    logout = False
+    if not use_cache:
+        con = snowflake.connector.connect(**connect_kwargs)
+    else:
+        con = open_cached_session()
+        if con is None:
+            with session_cache.login_lock(session_key):
+                # another thread may have logged in while this one waited
+                con = open_cached_session()
+                if con is None:
+                    con = snowflake.connector.connect(
+                        server_session_keep_alive=True, **connect_kwargs
+                    )
+                    # False when another process cached its session first
+                    logout = not session_cache.put(session_key, con)
 
     try:
         yield con
     finally:
         if not kwargs.get("autocommit", False):
             con.commit()  # commits when closing connection, used in cases such as `exec_sql_multi`
+        if logout:
+            con.rest.delete_session()
         con.close()
 
 
-def exec_sql_multi(sql: str) -> List[Tuple]:
-    results = []
+def rest_execute(sql: str, multi: bool = False) -> List[Tuple]:
+    import rest_transport
+    import snowflake.connector.errors
 
-    with get_snowflake_connection(
-        autocommit=False
-    ) as con:  # autocommit=False because multi is typically a transaction command, it's important for all the commands to execute succesfully - if autocommit=True, and only one succeeds, we will have partial execution
+    context = {
+        "database": DATABASE,
+        "schema": SCHEMA,
+        "role": ROLE,
+        "warehouse": None if METADATA_ONLY else WAREHOUSE,
+    }
+    with profiler.span(sql, cat="snowflake_io"):
         try:
-            cursor_list = con.execute_string(sql)
-            for cursor in cursor_list:
-                logging.debug(f"cursor_list: {cursor_list}")
-                with closing(cursor):
-                    try:
-                        for row in cursor:
-                            results.append(row)
-                    except TypeError:
-                        results.append(None)
-
-        except snowflake.connector.errors.ProgrammingError as e:
+            return rest_transport.execute(
+                sql,
+                ACCOUNT,
+                context,
+                parameters={"QUERY_TAG": query_tag()},
+                multi=multi,
+            )
+        except snowflake.connector.errors.ProgrammingError:
             logger.exception(f"Failed to execute query:\n{sql}")
             raise
 
-    return results
+
+def exec_sql_multi(sql: str) -> List[Tuple]:
+    import snowflake.connector.errors
+
+    check_compute(sql)
+    if transport() == "rest":
+        return run_statement(sql, lambda: rest_execute(sql, multi=True))
+
+    def execute() -> List[Tuple]:
+        results = []
+        with profiler.span(sql, cat="snowflake_io"), get_snowflake_connection(
+            autocommit=False
+        ) as con:  # autocommit=False because multi is typically a transaction command, it's important for all the commands to execute succesfully - if autocommit=True, and only one succeeds, we will have partial execution
+            try:
+                cursor_list = con.execute_string(sql)
+                for cursor in cursor_list:
+                    logging.debug(f"cursor_list: {cursor_list}")
+                    with closing(cursor):
+                        try:
+                            for row in cursor:
+                                results.append(row)
+                        except TypeError:
+                            results.append(None)
+
+            except snowflake.connector.errors.ProgrammingError as e:
+                logger.exception(f"Failed to execute query:\n{sql}")
+                raise
+        return results
+
+    return run_statement(sql, execute)
 
 
 def exec_sql(sql: str, autocommit: bool = True) -> List[Tuple]:
@@ -91,34 +405,177 @@ def exec_sql(sql: str, autocommit: bool = True) -> List[Tuple]:
         )
         return exec_sql_multi(sql)
     else:
-        result = []
-        # Note that this opens a new connection on each call, so it's not ideal
-        #   for performance executing many queries one after another
-        with get_snowflake_connection(autocommit=autocommit) as con:
-            with closing(con.cursor()) as cur:
-                try:
-                    cur.execute(sql)
-                    result = cur.fetchall()
+        import snowflake.connector.errors
 
-                except snowflake.connector.errors.ProgrammingError as e:
-                    logging.exception(f"Error executing sql:\n{sql}")
-                    raise
+        check_compute(sql)
+        if transport() == "rest":
+            return run_statement(sql, lambda: rest_execute(sql))
 
-        return result  # type: ignore
+        def execute() -> List[Tuple]:
+            result = []
+            # Note that this opens a new connection on each call, so it's not ideal
+            #   for performance executing many queries one after another
+            with profiler.span(sql, cat="snowflake_io"), get_snowflake_connection(
+                autocommit=autocommit
+            ) as con:
+                with closing(con.cursor()) as cur:
+                    try:
+                        cur.execute(sql)
+                        result = cur.fetchall()
 
+                    except snowflake.connector.errors.ProgrammingError as e:
+                        logging.exception(f"Error executing sql:\n{sql}")
+                        raise
+            return result
+
+        return run_statement(sql, execute)  # type: ignore
 
-def query_to_df(sql: str, autocommit: bool = True) -> pd.DataFrame:
-    logger.info(sql)
+
+def project_show(
+    cur: "snowflake.connector.cursor.SnowflakeCursor", columns: List[str]
+) -> List[Tuple]:
+    """
+    the rows of the SHOW command `cur` just ran, with only `columns`, in that order.
+    Columns this account's SHOW output doesn't have (e.g. by edition) are None. The
+    projection runs server-side through RESULT_SCAN in the same session, so the
+    wide SHOW rows never cross the wire. RESULT_SCAN needs a warehouse, so in
+    METADATA_ONLY mode the rows are projected client-side instead.
+    """
+    show_columns = [col[0].lower() for col in cur.description]
+    present = [col for col in columns if col in show_columns]
+    if METADATA_ONLY:
+        indexes = [show_columns.index(col) for col in present]
+        rows = [tuple(row[i] for i in indexes) for row in cur.fetchall()]
+    else:
+        select = ", ".join(f'"{col}"' for col in present)
+        project_sql = f"select {select} from table(result_scan('{cur.sfqid}'))"
+        check_compute(project_sql)
+        cur.execute(project_sql)
+        rows = cur.fetchall()
+    if len(present) < len(columns):
+        positions = {col: i for i, col in enumerate(present)}
+        rows = [
+            tuple(row[positions[col]] if col in positions else None for col in columns)
+            for row in rows
+        ]
+    return rows
+
+
+def iter_show(
+    sql: str,
+    columns: Optional[List[str]] = None,
+    paginate: bool = False,
+    page_size: int = SHOW_PAGE_SIZE,
+    prefetch: bool = True,
+) -> Iterator:
+    """
+    runs a SHOW command, yielding tuples of every column, or with `columns`, dicts
+    of only those columns by name (see project_show).
+    With `paginate`, it runs page by page with `LIMIT <page_size> FROM '<last name>'`,
+    so results larger than the SHOW row cap are complete. Only some commands (e.g.
+    SHOW DATABASES, SHOW SCHEMAS) accept that clause, the others run as one plain
+    SHOW. With prefetch, the next page is fetched in the background while the rows
+    of the current one are consumed. Rows repeated at a page boundary are only
+    yielded once.
+    """
+    import snowflake.connector.errors
+
+    check_compute(sql)
+    sql = sql.strip().rstrip(";")
+    # pages are keyed on the name of their last row
+    fetch_columns = columns + ["name"] if columns and "name" not in columns else columns
+
+    with get_snowflake_connection(autocommit=True) as con, ThreadPoolExecutor(
+        max_workers=1
+    ) as executor:
+
+        def fetch_page(start: Optional[str]) -> Tuple[List[str], List[Tuple]]:
+            page_sql = f"{sql} limit {page_size}" if paginate else sql
+            if start is not None:
+                page_sql += " from '" + start.replace("'", "\\'") + "'"
+
+            def execute() -> Tuple[List[str], List[Tuple]]:
+                with profiler.span(page_sql, cat="snowflake_io"):
+                    with closing(con.cursor()) as cur:
+                        try:
+                            cur.execute(page_sql)
+                            if fetch_columns:
+                                return fetch_columns, project_show(cur, fetch_columns)
+                            rows = cur.fetchall()
+                        except snowflake.connector.errors.ProgrammingError as e:
+                            logger.exception(f"Error executing sql:\n{page_sql}")
+                            raise
+                        return [col[0].lower() for col in cur.description], rows
+
+            return run_statement(page_sql, execute)
+
+        page = executor.submit(fetch_page, None)
+        previous_page = set()
+        while page is not None:
+            page_columns, rows = page.result()
+            page = None
+            more = paginate and len(rows) >= page_size
+            if more:
+                start = rows[-1][page_columns.index("name")]
+                if prefetch:
+                    page = executor.submit(fetch_page, start)
+            new_rows = [row for row in rows if row not in previous_page]
+            if columns:
+                yield from (dict(zip(columns, row)) for row in new_rows)
+            else:
+                yield from new_rows
+            if not new_rows:
+                # the page didn't move past the previous one, nothing left to read
+                break
+            if more and not prefetch:
+                page = executor.submit(fetch_page, start)
+            previous_page = set(rows)
+
+
+def iter_sql_batches(sql: str, autocommit: bool = True) -> Iterator[List[Dict]]:
+    """
+    streams a query's result as Arrow batches, each converted to a list of dicts
+    with lowercase keys, so a huge result is never held in memory all at once
+    """
+    import snowflake.connector.errors
+
+    check_compute(sql)
 
     with get_snowflake_connection(autocommit=autocommit) as con:
         with closing(con.cursor()) as cur:
             try:
-                cur.execute(sql)
-                df = cur.fetch_pandas_all()
-                df.columns = df.columns.str.lower()
+                with profiler.span(sql, cat="snowflake_io"):
+                    # only the statement is retried, the connector retries downloads
+                    run_statement(sql, lambda: cur.execute(sql))
+                for batch in cur.fetch_arrow_batches():
+                    yield batch.rename_columns(
+                        [col.lower() for col in batch.column_names]
+                    ).to_pylist()
 
             except snowflake.connector.errors.ProgrammingError as e:
-                logger.exception(f"Failed to fetch DataFrame using query:\n{sql}")
+                logger.exception(f"Failed to stream batches using query:\n{sql}")
                 raise
 
-    return df
+
+def query_to_df(sql: str, autocommit: bool = True) -> "pd.DataFrame":
+    import snowflake.connector.errors
+
+    logger.info(sql)
+    check_compute(sql)
+
+    def execute() -> "pd.DataFrame":
+        with profiler.span(sql, cat="snowflake_io"), get_snowflake_connection(
+            autocommit=autocommit
+        ) as con:
+            with closing(con.cursor()) as cur:
+                try:
+                    cur.execute(sql)
+                    df = cur.fetch_pandas_all()
+                    df.columns = df.columns.str.lower()
+
+                except snowflake.connector.errors.ProgrammingError as e:
+                    logger.exception(f"Failed to fetch DataFrame using query:\n{sql}")
+                    raise
+        return df
+
+    return run_statement(sql, execute)
@@ -0,0 +1,251 @@
+"""
+Keeps the account inventory warm and serves it locally, so CI jobs and reviewers
+get answers without scraping Snowflake themselves.
+
+    python terraformer/daemon.py --port 8765 --interval 3600
+    curl localhost:8765/status
+    curl 'localhost:8765/inventory?kind=SnowflakeSchema&database=RAW'
+    curl localhost:8765/hcl                       # list of generated files
+    curl 'localhost:8765/hcl?file=generated_database.tf'
+    curl localhost:8765/imports
+    curl -X POST localhost:8765/refresh
+
+Each refresh scrapes into a new snapshot directory under --state_dir, which
+replaces the served one once it is complete. Logged-in sessions are reused between
+refreshes through the session cache of client.py.
+"""
+
+import argparse
+import collections
+import contextlib
+import json
+import logging
+import os
+import shutil
+import socketserver
+import tempfile
+import threading
+import time
+import types
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import terraformer
+from inventory import Inventory
+
+logger = logging.getLogger(__name__)
+
+INVENTORY_FILENAME = "inventory.db"
+INVENTORY_FILTERS = ["kind", "database", "owner", "tf_filename"]
+
+
+class InventoryDaemon:
+    def __init__(self, state_dir, scrape_args, interval=None):
+        self.state_dir = os.path.abspath(state_dir)
+        self.scrape_args = scrape_args
+        self.interval = interval
+        self.snapshot_dir = None
+        self.summary = None
+        self.refreshed_at = None
+        self.refresh_requested = threading.Event()
+        self.refreshing = threading.Lock()
+        # a replaced snapshot is only removed once no request reads it anymore
+        self.snapshot_lock = threading.Lock()
+        self.readers = collections.Counter()
+        self.retired = set()
+
+    def refresh(self):
+        # only one refresh at a time, the served snapshot is swapped once it's done
+        with self.refreshing:
+            snapshots_dir = os.path.join(self.state_dir, "snapshots")
+            os.makedirs(snapshots_dir, exist_ok=True)
+            snapshot_dir = tempfile.mkdtemp(
+                dir=snapshots_dir, prefix=time.strftime("%Y%m%dT%H%M%S_")
+            )
+            args = argparse.Namespace(
+                **vars(self.scrape_args),
+                inventory=os.path.join(snapshot_dir, INVENTORY_FILENAME),
+            )
+            t = types.SimpleNamespace(working_dir=snapshot_dir, import_dir=snapshot_dir)
+            try:
+                summary = terraformer.run(t, args)
+            except Exception:
+                logger.exception("Refreshing the inventory failed")
+                shutil.rmtree(snapshot_dir, ignore_errors=True)
+                return
+            with self.snapshot_lock:
+                previous_dir = self.snapshot_dir
+                self.snapshot_dir, self.summary = snapshot_dir, summary
+                self.refreshed_at = time.time()
+                if previous_dir:
+                    self.retired.add(previous_dir)
+            if previous_dir:
+                self.release(previous_dir, reading=False)
+            logger.info(f"Inventory refreshed in {summary['seconds']:.0f}s")
+
+    @contextlib.contextmanager
+    def snapshot(self):
+        # the served snapshot directory (None before the first refresh), kept on
+        #   disk while the request reads it even if a refresh replaces it meanwhile
+        with self.snapshot_lock:
+            snapshot_dir = self.snapshot_dir
+            if snapshot_dir:
+                self.readers[snapshot_dir] += 1
+        try:
+            yield snapshot_dir
+        finally:
+            if snapshot_dir:
+                self.release(snapshot_dir)
+
+    def release(self, snapshot_dir, reading=True):
+        with self.snapshot_lock:
+            if reading:
+                self.readers[snapshot_dir] -= 1
+            if self.readers[snapshot_dir] or snapshot_dir not in self.retired:
+                return
+            self.readers.pop(snapshot_dir, None)
+            self.retired.discard(snapshot_dir)
+        shutil.rmtree(snapshot_dir, ignore_errors=True)
+
+    def refresh_loop(self):
+        # refreshes on every --interval, or as soon as one is requested
+        while True:
+            self.refresh()
+            self.refresh_requested.wait(timeout=self.interval)
+            self.refresh_requested.clear()
+
+    def status(self):
+        return {
+            "snapshot": self.snapshot_dir,
+            "refreshed_at": self.refreshed_at,
+            "refreshing": self.refreshing.locked(),
+            "summary": self.summary,
+        }
+
+    def inventory(self, snapshot_dir, **filters):
+        store = Inventory(os.path.join(snapshot_dir, INVENTORY_FILENAME))
+        try:
+            return [
+                dict(
+                    row,
+                    raw=json.loads(row["raw"]),
+                    extra_data=(
+                        json.loads(row["extra_data"]) if row["extra_data"] else None
+                    ),
+                )
+                for row in store.objects(include_excluded=True, **filters)
+            ]
+        finally:
+            store.close()
+
+    def generated_files(self, snapshot_dir):
+        return sorted(
+            f for f in os.listdir(snapshot_dir) if f.endswith((".tf", ".tf.json"))
+        )
+
+
+class Handler(BaseHTTPRequestHandler):
+    inventory_daemon: InventoryDaemon
+
+    def address_string(self):
+        # client_address is empty on a Unix socket
+        return self.client_address[0] if self.client_address else "unix"
+
+    def send(self, status, body, content_type="application/json"):
+        if content_type == "application/json":
+            body = json.dumps(body, default=str)
+        data = body.encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {k: v[0] for k, v in parse_qs(url.query).items()}
+        if url.path == "/status":
+            return self.send(HTTPStatus.OK, self.inventory_daemon.status())
+        with self.inventory_daemon.snapshot() as snapshot_dir:
+            if snapshot_dir is None:
+                return self.send(
+                    HTTPStatus.SERVICE_UNAVAILABLE, {"error": "first refresh running"}
+                )
+            self.send_snapshot(snapshot_dir, url.path, params)
+
+    def send_snapshot(self, snapshot_dir, path, params):
+        # answers from one snapshot, which stays on disk until this returns
+        if path == "/inventory":
+            filters = {k: v for k, v in params.items() if k in INVENTORY_FILTERS}
+            inventory = self.inventory_daemon.inventory(snapshot_dir, **filters)
+            return self.send(HTTPStatus.OK, inventory)
+        generated_files = self.inventory_daemon.generated_files(snapshot_dir)
+        if path == "/hcl" and "file" not in params:
+            return self.send(HTTPStatus.OK, generated_files)
+        if path in ["/hcl", "/imports"]:
+            filename = params["file"] if path == "/hcl" else terraformer.IMPORT_FILENAME
+            file_path = os.path.join(snapshot_dir, filename)
+            served = generated_files + [terraformer.IMPORT_FILENAME]
+            if filename not in served or not os.path.exists(file_path):
+                # e.g. no imports when the scrape found nothing to import
+                return self.send(HTTPStatus.NOT_FOUND, {"error": f"no {filename}"})
+            with open(file_path) as f:
+                return self.send(HTTPStatus.OK, f.read(), content_type="text/plain")
+        self.send(HTTPStatus.NOT_FOUND, {"error": f"unknown path {path}"})
+
+    def do_POST(self):
+        if urlparse(self.path).path == "/refresh":
+            self.inventory_daemon.refresh_requested.set()
+            return self.send(HTTPStatus.ACCEPTED, {"refresh": "requested"})
+        self.send(HTTPStatus.NOT_FOUND, {"error": f"unknown path {self.path}"})
+
+
+class ThreadingUnixHTTPServer(
+    socketserver.ThreadingMixIn, socketserver.UnixStreamServer
+):
+    daemon_threads = True
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--state_dir", default="terraformer_daemon")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--socket", help="serve on this Unix socket instead of a port")
+    parser.add_argument(
+        "--interval", type=int, help="seconds between refreshes, default on demand"
+    )
+    parser.add_argument(
+        "--workers", type=int, default=terraformer.snowflake_client.CONCURRENCY_MAX
+    )
+    parser.add_argument("--tables", action="store_true")
+    parser.add_argument("--metadata_only", action="store_true")
+    args = parser.parse_args()
+
+    scrape_args = argparse.Namespace(
+        metadata_only=args.metadata_only,
+        tables=args.tables,
+        workers=args.workers,
+        output_format="hcl",
+        synthesize_state=False,
+        provider_schema=None,
+        from_inventory=None,
+        profile=None,
+        resume=False,
+        render_workers=1,
+    )
+    inventory_daemon = InventoryDaemon(args.state_dir, scrape_args, args.interval)
+    Handler.inventory_daemon = inventory_daemon
+    threading.Thread(target=inventory_daemon.refresh_loop, daemon=True).start()
+
+    if args.socket:
+        if os.path.exists(args.socket):
+            os.remove(args.socket)
+        server = ThreadingUnixHTTPServer(args.socket, Handler)
+        logger.info(f"Serving the inventory on {args.socket}")
+    else:
+        # local only, the inventory describes the whole account
+        server = ThreadingHTTPServer(("127.0.0.1", args.port), Handler)
+        logger.info(f"Serving the inventory on http://127.0.0.1:{args.port}")
+    server.serve_forever()
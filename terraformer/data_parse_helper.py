@@ -60,3 +60,56 @@ def stage_parser(data:list):
                 data_dict[row[0]] = {}
             data_dict[row[0]][row[1]] = parse_field(row[3], row[2])
     return data_dict
+
+
+def column_type(row):
+    '''turns an `information_schema.columns` row into a Snowflake type string,
+    e.g. NUMBER(38,0), VARCHAR(16777216) or TIMESTAMP_NTZ(9)
+    '''
+    data_type = row['data_type']
+    if data_type == 'NUMBER':
+        return f"NUMBER({row['numeric_precision']},{row['numeric_scale']})"
+    elif data_type in ('TEXT', 'BINARY'):
+        name = 'VARCHAR' if data_type == 'TEXT' else data_type
+        return f"{name}({row['character_maximum_length']})"
+    elif data_type.startswith('TIMESTAMP') or data_type == 'TIME':
+        return f"{data_type}({row['datetime_precision']})"
+    else:
+        return data_type
+
+
+def group_table_columns(rows):
+    '''expects `information_schema.columns` rows joined with their table, ordered by
+    table_schema, table_name and ordinal_position. Yields one dict per table with its
+    columns under `columns`, so only one table is held in memory at a time.
+    '''
+    table = None
+    for row in rows:
+        if table is None or (row['table_schema'], row['table_name']) != (
+            table['table_schema'],
+            table['table_name'],
+        ):
+            if table is not None:
+                yield table
+            table = {
+                k: row[k]
+                for k in [
+                    'table_catalog',
+                    'table_schema',
+                    'table_name',
+                    'table_owner',
+                    'comment',
+                    'clustering_key',
+                ]
+            }
+            table['columns'] = []
+        table['columns'].append(
+            {
+                'name': row['column_name'],
+                'type': column_type(row),
+                'nullable': row['is_nullable'] == 'YES',
+                'comment': row['column_comment'],
+            }
+        )
+    if table is not None:
+        yield table
@@ -0,0 +1,177 @@
+import json
+import logging
+import sqlite3
+import threading
+from typing import Iterator, List, Optional
+
+from resources import (
+    SnowflakeDatabase,
+    SnowflakeStage,
+    SnowflakeWarehouse,
+    SnowflakeRole,
+    SnowflakeSchema,
+    SnowflakePipe,
+    SnowflakeFileFormat,
+    SnowflakeTable,
+    SnowflakeView,
+)
+
+logger = logging.getLogger(__name__)
+
+# resource classes by the `kind` stored in the inventory
+KINDS = {
+    cls.__name__: cls
+    for cls in [
+        SnowflakeDatabase,
+        SnowflakeStage,
+        SnowflakeWarehouse,
+        SnowflakeRole,
+        SnowflakeSchema,
+        SnowflakePipe,
+        SnowflakeFileFormat,
+        SnowflakeTable,
+        SnowflakeView,
+    ]
+}
+
+SCHEMA = """
+create table if not exists objects (
+    id integer primary key,
+    kind text not null,
+    resource_type text not null,
+    database text,
+    schema text,
+    name text not null,
+    owner text,
+    tf_filename text,
+    identifier text not null,
+    raw text not null,
+    extra_data text,
+    excluded integer not null,
+    unit text
+);
+create index if not exists objects_kind on objects (kind);
+create index if not exists objects_database on objects (database);
+create index if not exists objects_owner on objects (owner);
+create index if not exists objects_tf_filename on objects (tf_filename);
+"""
+
+# unit of work (see journal.py) that scraped the row, indexed so the rows of a
+#   failed or interrupted unit can be discarded
+UNIT_INDEX = "create index if not exists objects_unit on objects (unit)"
+
+# rows are committed in batches, so huge accounts spill to disk as they are scraped
+COMMIT_EVERY = 1000
+
+
+class Inventory:
+    """
+    A local SQLite store of every scraped object: its raw columns, parsed
+    `extra_data` and exclusion verdict. Resources can be rendered from it again
+    without connecting to Snowflake, and it can be queried by database, owner or kind.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.con = sqlite3.connect(path, check_same_thread=False)
+        self.con.execute("pragma journal_mode = wal")
+        self.con.execute("pragma synchronous = normal")
+        self.con.executescript(SCHEMA)
+        columns = [row[1] for row in self.con.execute("pragma table_info(objects)")]
+        if "unit" not in columns:
+            # inventories written before units were recorded
+            self.con.execute("alter table objects add column unit text")
+        self.con.execute(UNIT_INDEX)
+        self.lock = threading.Lock()
+        self.pending = 0
+
+    def add(self, resource, unit: Optional[str] = None) -> None:
+        extra_data = getattr(resource, "extra_data", None)
+        row = (
+            resource.__class__.__name__,
+            resource.snowflake_provider_resource,
+            resource.database or None,
+            resource.schema or None,
+            resource.name,
+            getattr(resource, "owner", None),
+            resource.tf_filename,
+            resource.identifier_resource,
+            json.dumps(resource.raw, default=str),
+            json.dumps(extra_data, default=str) if extra_data else None,
+            int(resource.excluded),
+            unit,
+        )
+        with self.lock:
+            self.con.execute(
+                "insert into objects (kind, resource_type, database, schema, name, "
+                "owner, tf_filename, identifier, raw, extra_data, excluded, unit) "
+                "values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                row,
+            )
+            self.pending += 1
+            if self.pending >= COMMIT_EVERY:
+                self.con.commit()
+                self.pending = 0
+
+    def commit(self) -> None:
+        with self.lock:
+            self.con.commit()
+            self.pending = 0
+
+    def discard_unit(self, unit: str) -> None:
+        # drops what a unit added, when it failed or is about to be run again
+        with self.lock:
+            self.con.execute("delete from objects where unit = ?", (unit,))
+            self.con.commit()
+            self.pending = 0
+
+    def close(self) -> None:
+        self.commit()
+        self.con.close()
+
+    def objects(
+        self,
+        kind: Optional[str] = None,
+        database: Optional[str] = None,
+        owner: Optional[str] = None,
+        tf_filename: Optional[str] = None,
+        include_excluded: bool = False,
+    ) -> Iterator[sqlite3.Row]:
+        # streams the matching rows in scrape order, using the indexes on each filter
+        filters = {
+            "kind": kind,
+            "database": database,
+            "owner": owner,
+            "tf_filename": tf_filename,
+        }
+        clauses = [f"{col} = ?" for col, val in filters.items() if val is not None]
+        params = [val for val in filters.values() if val is not None]
+        if not include_excluded:
+            clauses.append("excluded = 0")
+        where = f"where {' and '.join(clauses)}" if clauses else ""
+        cur = self.con.cursor()
+        cur.row_factory = sqlite3.Row
+        yield from cur.execute(f"select * from objects {where} order by id", params)
+
+    def tf_filenames(self) -> List[str]:
+        # every output file, e.g. to render them separately
+        rows = self.con.execute(
+            "select distinct tf_filename from objects order by tf_filename"
+        )
+        return [row[0] for row in rows]
+
+    def resources(self, **filters) -> Iterator:
+        """
+        rebuilds the scraped resources. The stored exclusion verdict is reapplied
+        instead of the exclusion rules, so the output matches the original scrape.
+        """
+        for row in self.objects(**filters):
+            kwargs = json.loads(row["raw"])
+            if row["extra_data"]:
+                kwargs["extra_data"] = json.loads(row["extra_data"])
+            resource = KINDS[row["kind"]](
+                attr_exclusion_rules={}, regex_exclusion_rules={}, **kwargs
+            )
+            if row["excluded"]:
+                resource.stop_resource()
+            yield resource
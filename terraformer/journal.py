@@ -0,0 +1,137 @@
+import json
+import logging
+import os
+import shutil
+import threading
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+JOURNAL_FILENAME = ".terraformer_journal.jsonl"
+STAGING_DIRNAME = ".terraformer_staging"
+
+
+class Journal:
+    """
+    A durable, append-only record of the units of work of a scrape (a phase, or a
+    phase for one database) and of what they produced, so `--resume` can skip the
+    units that are already done.
+
+    A unit writes its files into its own staging directory. They are only appended
+    to the real generated files once the unit succeeded, after the size of every
+    target file was journaled, so a crash in the middle of a commit can be rolled
+    back by truncating the targets. Each record is fsynced before moving on.
+    """
+
+    def __init__(self, tf_dir: str, resume: bool = False):
+        self.path = os.path.join(tf_dir, JOURNAL_FILENAME)
+        self.staging_root = os.path.join(tf_dir, STAGING_DIRNAME)
+        self.lock = threading.Lock()
+        # one commit at a time, so a crash can only interrupt the last one
+        self.commit_lock = threading.Lock()
+        self.done: Dict[str, dict] = {}
+        self.failed: Dict[str, str] = {}
+        committing: Dict[str, dict] = {}
+        if resume and os.path.exists(self.path):
+            with open(self.path, "r+b") as f:
+                for line in iter(f.readline, b""):
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # torn last line of a crashed run, cut before appending
+                        f.truncate(f.tell() - len(line))
+                        break
+                    if entry["status"] == "committing":
+                        committing[entry["unit"]] = entry
+                    elif entry["status"] == "done":
+                        committing.pop(entry["unit"], None)
+                        self.done[entry["unit"]] = entry
+                    elif entry["status"] == "rolled_back":
+                        committing.pop(entry["unit"], None)
+        elif os.path.exists(self.path):
+            os.remove(self.path)
+        shutil.rmtree(self.staging_root, ignore_errors=True)
+        for unit, entry in committing.items():
+            self.rollback(unit, entry["sizes"])
+
+    def record(self, **entry) -> None:
+        with self.lock, open(self.path, "a") as f:
+            f.write(json.dumps(entry, default=str) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def is_done(self, unit: str) -> bool:
+        return unit in self.done
+
+    def result(self, unit: str):
+        return self.done[unit].get("result")
+
+    def state(self, unit: str) -> List[dict]:
+        return self.done[unit].get("state") or []
+
+    def staging_dir(self, unit: str) -> str:
+        path = os.path.join(self.staging_root, unit.replace(":", "__"))
+        shutil.rmtree(path, ignore_errors=True)
+        os.makedirs(path)
+        return path
+
+    def fail(self, unit: str, staging_dir: str, error: Exception) -> None:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        self.failed[unit] = repr(error)
+        self.record(unit=unit, status="failed", error=repr(error))
+
+    def commit(
+        self,
+        unit: str,
+        staging_dir: str,
+        targets: Dict[str, str],
+        result=None,
+        state: Optional[List[dict]] = None,
+    ) -> List[str]:
+        """
+        appends the files a unit staged to their targets, `targets` maps a staged
+        filename to the path it belongs to. The unit's return value and state
+        entries are journaled with it, for resumed runs. Returns the paths written.
+        """
+        with self.commit_lock:
+            outputs = []
+            for filename in sorted(os.listdir(staging_dir)):
+                target = targets[filename]
+                if target.endswith(".tf.json") and os.path.exists(target):
+                    # a JSON document can't be appended to, like TfJsonWriter
+                    raise FileExistsError(f"{target} already exists, delete it first")
+                outputs.append((os.path.join(staging_dir, filename), target))
+            sizes = {
+                target: os.path.getsize(target) if os.path.exists(target) else None
+                for _, target in outputs
+            }
+            self.record(unit=unit, status="committing", sizes=sizes)
+            for staged, target in outputs:
+                with open(staged, "rb") as src, open(target, "ab") as dst:
+                    shutil.copyfileobj(src, dst)
+                    dst.flush()
+                    os.fsync(dst.fileno())
+            written = [target for _, target in outputs]
+            done = {"outputs": written, "result": result, "state": state}
+            self.record(unit=unit, status="done", **done)
+            self.done[unit] = done
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        return written
+
+    def close(self) -> None:
+        # staging directories of failed units are already gone
+        shutil.rmtree(self.staging_root, ignore_errors=True)
+
+    def rollback(self, unit: str, sizes: Dict[str, Optional[int]]) -> None:
+        # undoes a commit that was interrupted, by truncating what it appended
+        logger.warning(f"Rolling back the interrupted commit of {unit}")
+        for target, size in sizes.items():
+            if not os.path.exists(target):
+                # removed since, there is nothing left to undo
+                continue
+            if size is None:
+                os.remove(target)
+            else:
+                with open(target, "r+b") as f:
+                    f.truncate(size)
+        self.record(unit=unit, status="rolled_back")
@@ -0,0 +1,168 @@
+import cProfile
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+# Spans are no-ops unless profiling was switched on with `enable`
+ENABLED = False
+output_dir = "."
+
+_events: List[dict] = []
+_lock = threading.Lock()
+_t0 = time.perf_counter()
+phase_stats: Dict[str, dict] = {}
+# tracemalloc (and on Python 3.12+ cProfile) is process-wide, so a phase only gets
+#   its own peak memory (and profile) when no other phase ran at the same time
+_active_phases: Set[str] = set()
+_overlapped: Set[str] = set()
+_run_peak = 0
+# before Python 3.12, a cProfile profile only sees the thread that enabled it
+PROCESS_WIDE_PROFILER = sys.version_info >= (3, 12)
+
+
+def enable(directory: str) -> None:
+    global ENABLED, output_dir
+    ENABLED = True
+    output_dir = directory
+    os.makedirs(output_dir, exist_ok=True)
+    tracemalloc.start()
+
+
+def _now_us() -> float:
+    return (time.perf_counter() - _t0) * 1e6
+
+
+@contextmanager
+def span(name: str, cat: str = "step"):
+    """
+    times a block of code as a complete ("X") event of the Chrome trace format.
+    cat groups spans in the summary, e.g. snowflake_io / exclusion / render / write
+    """
+    if not ENABLED:
+        yield
+        return
+    start = _now_us()
+    try:
+        yield
+    finally:
+        event = {
+            "name": name,
+            "cat": cat,
+            "ph": "X",
+            "ts": start,
+            "dur": _now_us() - start,
+            "pid": os.getpid(),
+            "tid": threading.get_ident(),
+        }
+        with _lock:
+            _events.append(event)
+
+
+@contextmanager
+def phase(name: str):
+    """
+    a span around a whole scrape phase (tf_databases, tf_schemas, ...) which also
+    records the CPU time of its thread, a CPU profile (<output_dir>/<name>.prof) and
+    the tracemalloc peak. The peak (and on Python 3.12+ the profile) is only recorded
+    for a phase that ran on its own, e.g. with --workers 1, as it can't tell
+    concurrent phases apart.
+    """
+    if not ENABLED:
+        yield
+        return
+    with _lock:
+        if _active_phases:
+            _overlapped.update(_active_phases | {name})
+        else:
+            _fold_peak()
+            tracemalloc.reset_peak()
+        _active_phases.add(name)
+    profile: Optional[cProfile.Profile] = cProfile.Profile()
+    try:
+        profile.enable()
+    except ValueError:
+        # Python 3.12+ allows only one active profiler per process
+        logger.info(f"Not profiling {name}, another phase is being profiled")
+        profile = None
+    cpu_start = time.thread_time()
+    wall_start = time.perf_counter()
+    try:
+        with span(name, cat="phase"):
+            yield
+    finally:
+        cpu_s = time.thread_time() - cpu_start
+        with _lock:
+            _active_phases.discard(name)
+            alone = name not in _overlapped
+            peak = tracemalloc.get_traced_memory()[1] / 2**20 if alone else None
+        if profile is not None:
+            profile.disable()
+            if alone or not PROCESS_WIDE_PROFILER:
+                profile.dump_stats(os.path.join(output_dir, f"{name}.prof"))
+            else:
+                logger.info(f"Not writing {name}.prof, it ran with other phases")
+        phase_stats[name] = {
+            "wall_s": time.perf_counter() - wall_start,
+            "cpu_s": cpu_s,
+            "peak_mem_mb": peak,
+        }
+        if peak is not None:
+            with _lock:
+                _events.append(
+                    {
+                        "name": "tracemalloc_peak_mb",
+                        "ph": "C",
+                        "ts": _now_us(),
+                        "pid": os.getpid(),
+                        "args": {name: peak},
+                    }
+                )
+
+
+def _fold_peak() -> None:
+    # keeps the peak of the whole run across the resets of the phases
+    global _run_peak
+    _run_peak = max(_run_peak, tracemalloc.get_traced_memory()[1])
+
+
+def summary() -> str:
+    # total time per span category, to tell network from Python CPU from disk
+    totals: Dict[str, float] = defaultdict(float)
+    with _lock:
+        for event in _events:
+            if event["ph"] == "X" and event["cat"] != "phase":
+                totals[event["cat"]] += event["dur"] / 1e6
+        _fold_peak()
+    lines = [f"{'phase':<20}{'wall_s':>10}{'cpu_s':>10}{'peak_mem_mb':>14}"]
+    for name, stats in phase_stats.items():
+        # no peak for phases that ran with others
+        peak = stats["peak_mem_mb"]
+        lines.append(
+            f"{name:<20}{stats['wall_s']:>10.2f}{stats['cpu_s']:>10.2f}"
+            + (f"{peak:>14.1f}" if peak is not None else f"{'-':>14}")
+        )
+    lines.append(f"{'whole run':<40}{_run_peak / 2**20:>14.1f}")
+    lines.append("")
+    lines.extend(f"{cat:<20}{seconds:>10.2f}" for cat, seconds in totals.items())
+    return "\n".join(lines)
+
+
+def write(filename: str = "trace.json") -> str:
+    """
+    writes every span as a Chrome trace file, which can be opened in
+    chrome://tracing, https://ui.perfetto.dev or https://speedscope.app
+    """
+    path = os.path.join(output_dir, filename)
+    with _lock, open(path, "w") as f:
+        json.dump({"traceEvents": _events, "displayTimeUnit": "ms"}, f)
+    logger.info(f"Wrote profiling trace to {path}")
+    return path
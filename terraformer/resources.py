@@ -2,6 +2,8 @@ import json
 import logging
 import os
 import re
+import threading
+import profiler
 from numbers import Number
 from posixpath import supports_unicode_filenames
 from typing import Optional
@@ -11,6 +13,62 @@ logging.basicConfig(level=logging.WARN)
 
 escape = lambda s: s.encode("unicode_escape").decode("utf-8")
 
+# serializes appends to the generated files when resources are written from threads
+file_lock = threading.Lock()
+
+# "hcl" appends HCL to the .tf files, "json" streams Terraform JSON to .tf.json files
+OUTPUT_FORMAT = "hcl"
+
+
+def escape_templates(obj):
+    # strings in .tf.json are templates, escape interpolations so they stay literal
+    if isinstance(obj, str):
+        return obj.replace("${", "$${").replace("%{", "%%{")
+    elif isinstance(obj, list):
+        return [escape_templates(x) for x in obj]
+    elif isinstance(obj, dict):
+        return {k: escape_templates(v) for k, v in obj.items()}
+    return obj
+
+
+class TfJsonWriter:
+    """
+    streams resources into a `.tf.json` file as `{"resource": [{...}, {...}]}`, one
+    resource at a time. A JSON document can't be appended to, so unlike the HCL
+    files this refuses to touch an existing file, and must be closed to be valid.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "x")
+        self.file.write('{"resource": [\n')
+        self.empty = True
+
+    def write(self, block):
+        self.file.write(("" if self.empty else ",\n") + json.dumps(block))
+        self.empty = False
+
+    def close(self):
+        self.file.write("\n]}\n")
+        self.file.close()
+
+
+json_writers = {}
+
+
+def json_writer(path):
+    if path not in json_writers:
+        json_writers[path] = TfJsonWriter(path)
+    return json_writers[path]
+
+
+def close_outputs(directory=None):
+    # finishes every .tf.json file written so far, or only those in `directory`
+    with file_lock:
+        for path in list(json_writers):
+            if directory is None or os.path.dirname(path) == directory:
+                json_writers.pop(path).close()
+
 
 def stringify(obj, surround=True):
     # turns a data structure into a string that complies with terraform syntax
@@ -28,6 +86,52 @@ def stringify(obj, surround=True):
         raise TypeError(f"Unsupported type: {type(obj)}")
 
 
+def mask_nested(sql):
+    # blanks out quoted strings and identifiers and everything in parentheses,
+    #   keeping the positions, so keywords and commas are only found at the top level
+    masked, quote, depth = [], None, 0
+    i = 0
+    while i < len(sql):
+        c = sql[i]
+        if quote:
+            if c == "\\" and quote == "'":
+                masked.append("  ")
+                i += 2
+                continue
+            if c == quote:
+                if sql[i + 1 : i + 2] == quote:
+                    # a doubled quote is an escaped one
+                    masked.append("  ")
+                    i += 2
+                    continue
+                quote = None
+            masked.append(" ")
+        elif c in "'\"":
+            quote = c
+            masked.append(" ")
+        elif c == "(":
+            depth += 1
+            masked.append(" ")
+        elif c == ")":
+            depth = max(0, depth - 1)
+            masked.append(" ")
+        else:
+            masked.append(" " if depth else c)
+        i += 1
+    return "".join(masked)[: len(sql)]
+
+
+def split_top_level(sql, separator=","):
+    # splits on the separators outside quotes and parentheses, e.g. `a, substr(b, 1)`
+    parts, start = [], 0
+    for i, c in enumerate(mask_nested(sql)):
+        if c == separator:
+            parts.append(sql[start:i].strip())
+            start = i + 1
+    parts.append(sql[start:].strip())
+    return [part for part in parts if part]
+
+
 class SnowflakeResource:
     # These get set to something else in the child classes upon instantiation
     tf_filename = ""
@@ -36,8 +140,18 @@ class SnowflakeResource:
     database = ""
     name = ""
     resource_attributes = {}
+    # nested blocks, e.g. a table's columns, as a list of (block type, attributes)
+    resource_blocks = []
+    # raw values of resource_attributes (and blocks), for OUTPUT_FORMAT = "json"
+    tf_values = {}
+    # set by stop_resource when an exclusion rule matches
+    excluded = False
+    # whether this resource can go into a synthesized terraform.tfstate
+    state_importable = True
 
     def __init__(self, **kwargs):
+        # the scraped columns this resource was built from, kept for the inventory
+        self.raw = {k: v for k, v in kwargs.items() if not k.endswith("_rules")}
         regex_exclusion_rules = (
             kwargs["regex_exclusion_rules"]
             if "regex_exclusion_rules" in kwargs
@@ -48,14 +162,15 @@ class SnowflakeResource:
             if "attr_exclusion_rules" in kwargs
             else default_attr_exclusion_rules
         )
-        for attr, exclusions in attr_exclusion_rules.items():
-            if hasattr(self, attr) and getattr(self, attr).lower() in exclusions:
-                # if This item meets the exclusion criteria, skip it.
-                self.stop_resource()
-        for clas, patterns in regex_exclusion_rules.items():
-            for pattern in patterns:
-                if isinstance(self, clas) and re.search(pattern, self.name.lower()):
+        with profiler.span(self.__class__.__name__, cat="exclusion"):
+            for attr, exclusions in attr_exclusion_rules.items():
+                if hasattr(self, attr) and getattr(self, attr).lower() in exclusions:
+                    # if This item meets the exclusion criteria, skip it.
                     self.stop_resource()
+            for clas, patterns in regex_exclusion_rules.items():
+                for pattern in patterns:
+                    if isinstance(self, clas) and re.search(pattern, self.name.lower()):
+                        self.stop_resource()
 
     def stop_resource(self):
         """
@@ -66,29 +181,58 @@ class SnowflakeResource:
         warn = lambda: logger.warn(
             f"{self.snowflake_provider_resource} {self.name} won't be managed by Terraform"
         )
+        self.excluded = True
         self.append_tf_code_to_file = lambda *args, **kwargs: warn()  # type: ignore
         self.append_import_command_to_file = lambda *args, **kwargs: warn()  # type: ignore
 
+    def tf_code(self):
+        """renders the resource as an HCL resource block"""
+        nl = "\n"
+        nlss = "\n  "
+        blocks = "".join(
+            f"{nlss}{block} {{"
+            + "".join(f"{nlss}  {k} = {v}" for k, v in attrs.items() if v)
+            + f"{nlss}}}"
+            for block, attrs in self.resource_blocks
+        )
+        return (
+            f'resource "{self.snowflake_provider_resource}" "{self.alias_resource}" {{ {nlss}'
+            f"{nlss.join([f'{k} = {v}' for k, v in self.resource_attributes.items() if v])}"
+            f"{blocks}{nl}}}"
+        )
+
+    def tf_json(self):
+        """renders the resource as a Terraform JSON resource object"""
+        values = {k: v for k, v in self.tf_values.items() if v is not None and v != ""}
+        return {
+            self.snowflake_provider_resource: {
+                self.alias_resource: escape_templates(values)
+            }
+        }
+
     def append_tf_code_to_file(self, file_dir=".", filename=None):
         """
-        takes all the class attributes and writes them to a terraform file
+        takes all the class attributes and writes them to a terraform file,
+        in the format of OUTPUT_FORMAT
         ARGUMENTS
             filename = the filename to write to, defaults to self.tf_filename
         """
         if not filename:
             filename = self.tf_filename
-        if self.tf_filename:
-            nl = "\n"
-            nlss = "\n  "
-            tfstr = (
-                f'resource "{self.snowflake_provider_resource}" "{self.alias_resource}" {{ {nlss}'
-                f"{nlss.join([f'{k} = {v}' for k, v in self.resource_attributes.items() if v])}"
-                f"{nl}}}"
-            )
-            with open(os.path.join(file_dir, filename), "a+") as f:
-                f.write(tfstr + "\n\n")
-        else:
+        if not self.tf_filename:
             raise ValueError(f"Resource not initialized properly, name = {self.name}")
+        if OUTPUT_FORMAT == "json":
+            with profiler.span(self.snowflake_provider_resource, cat="render"):
+                block = self.tf_json()
+            with profiler.span(filename, cat="write"), file_lock:
+                json_writer(os.path.join(file_dir, filename + ".json")).write(block)
+        else:
+            with profiler.span(self.snowflake_provider_resource, cat="render"):
+                tfstr = self.tf_code()
+            with profiler.span(filename, cat="write"), file_lock, open(
+                os.path.join(file_dir, filename), "a+"
+            ) as f:
+                f.write(tfstr + "\n\n")
 
     def append_import_command_to_file(self, file_dir=".", filename=None):
         """
@@ -99,16 +243,20 @@ class SnowflakeResource:
         if not filename:
             filename = self.tf_filename.replace(".tf", ".sh")
         if self.tf_filename:
-            with open(os.path.join(file_dir, filename), "a+") as f:
+            with profiler.span(filename, cat="write"), file_lock, open(
+                os.path.join(file_dir, filename), "a+"
+            ) as f:
                 f.write(self.tf_import_string + "\n")
         else:
             raise ValueError("Resource not initialized properly")
 
     @property
     def tf_import_string(self):
-        if not all([os.getenv("SNOWFLAKE_USER"), os.getenv("SNOWFLAKE_PASSWORD")]):
+        if not os.getenv("SNOWFLAKE_USER") or not any(
+            [os.getenv("SNOWFLAKE_PASSWORD"), os.getenv("SNOWFLAKE_PRIVATE_KEY_PATH")]
+        ):
             logger.warn(
-                "SNOWFLAKE_USER, SNOWFLAKE_PASSWORD "
+                "SNOWFLAKE_USER and SNOWFLAKE_PASSWORD (or SNOWFLAKE_PRIVATE_KEY_PATH) "
                 "environment variables must be set"
             )
         return (
@@ -152,6 +300,11 @@ class SnowflakeDatabase(SnowflakeResource):
         # snowflake_provider_resource is the Snowflake Resource type
         return "snowflake_database"
 
+    @property
+    def tf_values(self):
+        # raw values of resource_attributes, for the Terraform JSON backend
+        return {"name": self.name, "comment": self.comment}
+
     @property
     def resource_attributes(self):
         # These are the Terraform-configurable attributes that go into the
@@ -187,6 +340,36 @@ class SnowflakeStage(SnowflakeResource):
     def snowflake_provider_resource(self):
         return "snowflake_stage"
 
+    @property
+    def tf_values(self):
+        values = {
+            "name": self.name,
+            "database": self.database,
+            "schema": self.schema,
+            "comment": self.comment,
+            "storage_integration": self.storage_integration,
+            "url": self.url,
+        }
+        # see resource_attributes for the format of extra_data
+        options = {
+            "STAGE_COPY_OPTIONS": "copy_options",
+            "STAGE_FILE_FORMAT": "file_format",
+        }
+        for parent, property in (self.extra_data or {}).items():
+            if parent in options:
+                values[options[parent]] = " ".join(
+                    f"{k} = {self.option_value(v)}" for k, v in property.items()
+                )
+        return values
+
+    @staticmethod
+    def option_value(value):
+        # like stringify(value, surround=False), but unescaped: the JSON encoder
+        #   escapes the whole option string once
+        if isinstance(value, list):
+            return "[" + ",".join(f'"{v}"' for v in value) + "]"
+        return stringify(value, surround=False)
+
     @property
     def resource_attributes(self):
         attrs = {
@@ -260,6 +443,24 @@ class SnowflakeWarehouse(SnowflakeResource):
     def snowflake_provider_resource(self):
         return "snowflake_warehouse"
 
+    @property
+    def tf_values(self):
+        return {
+            "name": self.name,
+            "warehouse_size": self.size,
+            "min_cluster_count": int(self.min_cluster_count),
+            "max_cluster_count": int(self.max_cluster_count),
+            "auto_suspend": self.auto_suspend,
+            "auto_resume": self.auto_resume,
+            "comment": self.comment,
+            "scaling_policy": self.scaling_policy,
+            "max_concurrency_level": int(self.max_concurrency_level),
+            "statement_queued_timeout_in_seconds": int(
+                self.statement_queued_timeout_in_seconds
+            ),
+            "statement_timeout_in_seconds": int(self.statement_timeout_in_seconds),
+        }
+
     @property
     def resource_attributes(self):
         return {
@@ -284,6 +485,9 @@ class SnowflakeWarehouse(SnowflakeResource):
 
 
 class SnowflakeRole(SnowflakeResource):
+    # Role imports are commented out for safety, keep them out of the state too
+    state_importable = False
+
     def __init__(self, **kwargs):
         self.tf_filename = "generated_roles.tf"
         # sample import:
@@ -313,6 +517,10 @@ class SnowflakeRole(SnowflakeResource):
         # non-default identifier_resource
         return f"{self.name}"
 
+    @property
+    def tf_values(self):
+        return {"name": self.name, "comment": self.comment}
+
     @property
     def resource_attributes(self):
         return {
@@ -349,6 +557,10 @@ class SnowflakeSchema(SnowflakeResource):
     def snowflake_provider_resource(self):
         return "snowflake_schema"
 
+    @property
+    def tf_values(self):
+        return {"name": self.name, "database": self.database, "comment": self.comment}
+
     @property
     def resource_attributes(self):
         return {
@@ -360,11 +572,11 @@ class SnowflakeSchema(SnowflakeResource):
 
 class SnowflakePipe(SnowflakeResource):
     def __init__(self, **kwargs):
-        self.tf_filename = "generated_pipes.tf"
         # sample import:
         # tf import snowflake_pipe.raw_kinesis_clicks 'RAW|KINESIS|CLICKS'
         self.name = kwargs["pipe_name"]
         self.database = kwargs["pipe_catalog"]
+        self.tf_filename = f"generated_pipes_{self.database.lower()}.tf"
         self.comment = kwargs["comment"]
         self.schema = kwargs["pipe_schema"]
         self.copy_statement = kwargs["definition"]
@@ -382,6 +594,17 @@ class SnowflakePipe(SnowflakeResource):
     def snowflake_provider_resource(self):
         return "snowflake_pipe"
 
+    @property
+    def tf_values(self):
+        return {
+            "name": self.name,
+            "database": self.database,
+            "schema": self.schema,
+            "comment": self.comment,
+            "auto_ingest": self.auto_ingest == "YES",
+            "copy_statement": self.copy_statement,
+        }
+
     @property
     def resource_attributes(self):
         return {
@@ -396,20 +619,20 @@ class SnowflakePipe(SnowflakeResource):
 
 class SnowflakeFileFormat(SnowflakeResource):
     def __init__(self, **kwargs):
-        self.tf_filename = "generated_file_formats.tf"
         # sample import:
         # tf import snowflake_file_format.raw_adwords_stitch_loading_file_format_v1 'RAW|ADWORDS|STITCH_LOADING_FILE_FORMAT_V1'
         # Required
         self.name = kwargs["name"]
         self.database = kwargs["database_name"]
+        self.tf_filename = f"generated_file_formats_{self.database.lower()}.tf"
         self.schema = kwargs["schema_name"]
         self.format_type = kwargs["type"]
         # Optionals
         self.owner = kwargs["owner"]
         self.comment = kwargs["comment"]
-        self.format_options = json.loads(kwargs["format_options"])
+        self.raw_format_options = json.loads(kwargs["format_options"])
         self.format_options = {
-            k.lower(): self.parse_option(v) for k, v in self.format_options.items()
+            k.lower(): self.parse_option(v) for k, v in self.raw_format_options.items()
         }
         super().__init__(**kwargs)
 
@@ -449,6 +672,21 @@ class SnowflakeFileFormat(SnowflakeResource):
     def snowflake_provider_resource(self):
         return "snowflake_file_format"
 
+    @property
+    def tf_values(self):
+        values = {
+            "name": self.name,
+            "database": self.database,
+            "schema": self.schema,
+            "format_type": self.format_type,
+            "comment": self.comment,
+        }
+        # the options as Snowflake returned them, not the HCL from parse_option
+        values.update({k.lower(): v for k, v in self.raw_format_options.items()})
+        if "type" in values:
+            values["format_type"] = values.pop("type")
+        return values
+
     @property
     def resource_attributes(self):
         res_attr = {
@@ -466,6 +704,137 @@ class SnowflakeFileFormat(SnowflakeResource):
         return res_attr
 
 
+class SnowflakeTable(SnowflakeResource):
+    def __init__(self, **kwargs):
+        # sample import:
+        # tf import snowflake_table.raw_public_orders 'RAW|PUBLIC|ORDERS'
+        self.name = kwargs["table_name"]
+        self.database = kwargs["table_catalog"]
+        self.schema = kwargs["table_schema"]
+        self.owner = kwargs["table_owner"]
+        # information_schema comments are NULL rather than empty
+        self.comment = kwargs["comment"] or ""
+        self.cluster_by = kwargs["clustering_key"]
+        # list of {"name", "type", "nullable", "comment"} dicts, in column order
+        self.columns = kwargs["columns"]
+        self.tf_filename = f"generated_tables_{self.database.lower()}.tf"
+        super().__init__(**kwargs)
+
+    @property
+    def identifier_resource(self):
+        # non-default identifier_resource
+        return f"{self.database}|{self.schema}|{self.name}"
+
+    @property
+    def snowflake_provider_resource(self):
+        return "snowflake_table"
+
+    @property
+    def cluster_by_keys(self):
+        # clustering_key looks like `LINEAR(col_a, substr(col_b, 1, 3))`
+        cluster_by = re.match(r"^LINEAR\((.*)\)$", self.cluster_by or "", re.DOTALL)
+        return split_top_level(cluster_by.group(1)) if cluster_by else None
+
+    @property
+    def tf_values(self):
+        return {
+            "name": self.name,
+            "database": self.database,
+            "schema": self.schema,
+            "comment": self.comment,
+            "cluster_by": self.cluster_by_keys,
+            "column": [
+                {k: col[k] for k in ["name", "type", "nullable", "comment"]}
+                for col in self.columns
+            ],
+        }
+
+    @property
+    def resource_attributes(self):
+        cluster_by = self.cluster_by_keys
+        return {
+            "name": stringify(self.name),
+            "database": stringify(self.database),
+            "schema": stringify(self.schema),
+            "comment": stringify(self.comment),
+            "cluster_by": stringify(cluster_by) if cluster_by else None,
+        }
+
+    @property
+    def resource_blocks(self):
+        return [
+            (
+                "column",
+                {
+                    "name": stringify(col["name"]),
+                    "type": stringify(col["type"]),
+                    "nullable": stringify(col["nullable"]),
+                    "comment": stringify(col["comment"] or ""),
+                },
+            )
+            for col in self.columns
+        ]
+
+
+class SnowflakeView(SnowflakeResource):
+    def __init__(self, **kwargs):
+        # sample import:
+        # tf import snowflake_view.analytics_public_orders_v 'ANALYTICS|PUBLIC|ORDERS_V'
+        self.name = kwargs["table_name"]
+        self.database = kwargs["table_catalog"]
+        self.schema = kwargs["table_schema"]
+        self.owner = kwargs["table_owner"]
+        # information_schema comments are NULL rather than empty
+        self.comment = kwargs["comment"] or ""
+        self.is_secure = kwargs["is_secure"]
+        self.statement = self.parse_statement(kwargs["view_definition"])
+        self.tf_filename = f"generated_views_{self.database.lower()}.tf"
+        super().__init__(**kwargs)
+
+    @staticmethod
+    def parse_statement(view_definition):
+        # view_definition is the whole DDL, the provider only wants the query. The
+        #   query starts after the first `as` outside the comment and column list.
+        ddl = view_definition or ""
+        match = re.match(
+            r"^\s*create\s.*?\bview\b.*?\bas\b\s*",
+            mask_nested(ddl),
+            flags=re.IGNORECASE | re.DOTALL,
+        )
+        return (ddl[match.end() :] if match else ddl).rstrip().rstrip(";")
+
+    @property
+    def identifier_resource(self):
+        # non-default identifier_resource
+        return f"{self.database}|{self.schema}|{self.name}"
+
+    @property
+    def snowflake_provider_resource(self):
+        return "snowflake_view"
+
+    @property
+    def tf_values(self):
+        return {
+            "name": self.name,
+            "database": self.database,
+            "schema": self.schema,
+            "comment": self.comment,
+            "is_secure": self.is_secure == "YES",
+            "statement": self.statement,
+        }
+
+    @property
+    def resource_attributes(self):
+        return {
+            "name": stringify(self.name),
+            "database": stringify(self.database),
+            "schema": stringify(self.schema),
+            "comment": stringify(self.comment),
+            "is_secure": "true" if self.is_secure == "YES" else None,
+            "statement": "<<EOT\n" + self.statement + "\nEOT",
+        }
+
+
 ## EXCLUSIONS:
 # These are things you *don't* want Terraform to manage.
 # You won't catch all the exclusions, so make sure to review your import statements
@@ -0,0 +1,260 @@
+"""
+Runs statements through the Snowflake SQL API (`POST /api/v2/statements`) instead
+of the connector: there is no login or session to open, every statement is an
+HTTPS request over a keep-alive connection that each thread reuses. Statements
+are submitted asynchronously and polled until they finish, and results larger
+than one response are downloaded partition by partition.
+
+Select it with SNOWFLAKE_TRANSPORT=rest, client.py then routes `exec_sql` and
+`exec_sql_multi` here. It authenticates with SNOWFLAKE_PRIVATE_KEY_PATH (a key-pair
+JWT) or SNOWFLAKE_OAUTH_TOKEN. Set SNOWFLAKE_SQL_API_URL, e.g. to
+http://127.0.0.1:8080, to send the requests to a local stand-in of the API such
+as sql_api_stub.py.
+"""
+
+import datetime
+import decimal
+import gzip
+import http.client
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlencode, urlparse
+
+from auth import JWT_LIFETIME_SECONDS, EXPIRY_MARGIN_SECONDS, keypair_jwt
+
+logger = logging.getLogger(__name__)
+
+STATEMENTS_PATH = "/api/v2/statements"
+# server-side timeout of a statement, 0 would mean the account's maximum
+STATEMENT_TIMEOUT_SECONDS = 3600
+# seconds before the socket of a request gives up
+HTTP_TIMEOUT_SECONDS = 120
+# running statements are polled with a growing interval
+POLL_INITIAL_SECONDS = 0.05
+POLL_MAX_SECONDS = 2.0
+
+EPOCH = datetime.datetime(1970, 1, 1)
+
+# one keep-alive connection per thread and server
+local = threading.local()
+
+# the key-pair JWT is signed once and reused until it is about to expire
+jwt_lock = threading.Lock()
+jwt_cache: Dict[str, Tuple[str, float]] = {}
+
+
+def base_url(account: str) -> str:
+    return (
+        os.environ.get("SNOWFLAKE_SQL_API_URL")
+        or f"https://{account}.snowflakecomputing.com"
+    )
+
+
+def auth_headers(account: str) -> Dict[str, str]:
+    if os.environ.get("SNOWFLAKE_PRIVATE_KEY_PATH"):
+        if not os.environ.get("SNOWFLAKE_USER"):
+            raise OSError("Missing env var: SNOWFLAKE_USER")
+        with jwt_lock:
+            token, expires_at = jwt_cache.get(account, (None, 0.0))
+            if expires_at < time.time() + EXPIRY_MARGIN_SECONDS:
+                token = keypair_jwt(
+                    account,
+                    os.environ["SNOWFLAKE_USER"],
+                    os.environ["SNOWFLAKE_PRIVATE_KEY_PATH"],
+                    os.environ.get("SNOWFLAKE_PRIVATE_KEY_PASSPHRASE"),
+                )
+                jwt_cache[account] = (token, time.time() + JWT_LIFETIME_SECONDS)
+        token_type = "KEYPAIR_JWT"
+    elif os.environ.get("SNOWFLAKE_OAUTH_TOKEN"):
+        token, token_type = os.environ["SNOWFLAKE_OAUTH_TOKEN"], "OAUTH"
+    else:
+        raise OSError(
+            "The SQL API transport needs SNOWFLAKE_PRIVATE_KEY_PATH or"
+            " SNOWFLAKE_OAUTH_TOKEN"
+        )
+    return {
+        "Authorization": f"Bearer {token}",
+        "X-Snowflake-Authorization-Token-Type": token_type,
+    }
+
+
+def connection(url: str) -> http.client.HTTPConnection:
+    connections = local.__dict__.setdefault("connections", {})
+    if url not in connections:
+        parsed = urlparse(url)
+        if parsed.scheme == "https":
+            connections[url] = http.client.HTTPSConnection(
+                parsed.netloc, timeout=HTTP_TIMEOUT_SECONDS
+            )
+        else:
+            connections[url] = http.client.HTTPConnection(
+                parsed.netloc, timeout=HTTP_TIMEOUT_SECONDS
+            )
+    return connections[url]
+
+
+def request(
+    account: str, method: str, path: str, body: Optional[dict] = None
+) -> Tuple[int, dict]:
+    import snowflake.connector.errors
+
+    url = base_url(account)
+    headers = {
+        "Accept": "application/json",
+        "Accept-Encoding": "gzip",
+        "User-Agent": "terraformer/1.0",
+        **auth_headers(account),
+    }
+    data = None
+    if body is not None:
+        data = json.dumps(body).encode()
+        headers["Content-Type"] = "application/json"
+    for attempt in range(2):
+        con = connection(url)
+        if attempt and method == "POST":
+            # the requestId makes a resubmitted statement run only once
+            path += "&retry=true"
+        try:
+            con.request(method, path, body=data, headers=headers)
+            response = con.getresponse()
+            content = response.read()
+            break
+        except (http.client.HTTPException, OSError) as e:
+            # the server may close an idle keep-alive connection, reconnect once.
+            #   OSError also covers socket timeouts and SSL errors, which end up
+            #   as an InterfaceError that client.run_statement retries
+            con.close()
+            del local.connections[url]
+            if attempt:
+                raise snowflake.connector.errors.InterfaceError(
+                    msg=f"{method} {path} failed: {e!r}"
+                )
+    if response.getheader("Content-Encoding") == "gzip":
+        content = gzip.decompress(content)
+    return response.status, json.loads(content) if content else {}
+
+
+def error(status: int, body: dict) -> Exception:
+    # the connector's exceptions, so client.py retries and reports them the same way
+    import snowflake.connector.errors as errors
+
+    http_errors = {
+        408: "RequestTimeoutError",
+        429: "TooManyRequests",
+        500: "InternalServerError",
+        502: "BadGatewayError",
+        503: "ServiceUnavailableError",
+        504: "GatewayTimeoutError",
+    }
+    name = http_errors.get(status) or (
+        "OtherHTTPRetryableError" if status >= 500 else "ProgrammingError"
+    )
+    message = f"HTTP {status}: {body.get('message', body)}"
+    if name != "ProgrammingError":
+        # the HTTP errors take the status as their errno
+        # TooManyRequests only exists in recent connector versions
+        error_type = getattr(errors, name, errors.OtherHTTPRetryableError)
+        return error_type(msg=message, errno=status)
+    code = body.get("code")
+    return errors.ProgrammingError(
+        msg=message,
+        errno=int(code) if str(code).isdigit() else None,
+        sqlstate=body.get("sqlState"),
+        sfqid=body.get("statementHandle"),
+    )
+
+
+def wait(account: str, status: int, body: dict) -> dict:
+    # polls a statement that is still running (202) until its result is ready
+    delay = POLL_INITIAL_SECONDS
+    while status == 202:
+        logger.debug(f"Waiting for statement {body['statementHandle']}")
+        time.sleep(delay)
+        delay = min(POLL_MAX_SECONDS, delay * 2)
+        status, body = request(
+            account, "GET", f"{STATEMENTS_PATH}/{body['statementHandle']}"
+        )
+    if status != 200:
+        raise error(status, body)
+    return body
+
+
+def convert(value: Optional[str], column: dict):
+    # values come as strings, typed like the connector would from the rowType
+    if value is None:
+        return None
+    kind = column["type"].lower()
+    if kind == "fixed":
+        return decimal.Decimal(value) if column.get("scale") else int(value)
+    if kind == "real":
+        return float(value)
+    if kind == "boolean":
+        return value.lower() == "true"
+    if kind == "date":
+        return (EPOCH + datetime.timedelta(days=int(value))).date()
+    if kind == "timestamp_ntz":
+        return EPOCH + datetime.timedelta(seconds=float(value))
+    if kind == "timestamp_ltz":
+        return datetime.datetime.fromtimestamp(float(value), datetime.timezone.utc)
+    if kind == "timestamp_tz":
+        # "<epoch seconds> <offset in minutes + 1440>"
+        seconds, offset = value.split()
+        tz = datetime.timezone(datetime.timedelta(minutes=int(offset) - 1440))
+        return datetime.datetime.fromtimestamp(float(seconds), tz)
+    return value
+
+
+def result_rows(account: str, result: dict) -> List[Tuple]:
+    # the rows of every partition of a finished statement, typed
+    meta = result["resultSetMetaData"]
+    data = list(result.get("data") or [])
+    for partition in range(1, len(meta.get("partitionInfo") or [])):
+        path = f"{STATEMENTS_PATH}/{result['statementHandle']}?partition={partition}"
+        status, body = request(account, "GET", path)
+        if status != 200:
+            raise error(status, body)
+        data.extend(body.get("data") or [])
+    row_type = meta["rowType"]
+    return [
+        tuple(convert(value, column) for value, column in zip(row, row_type))
+        for row in data
+    ]
+
+
+def execute(
+    sql: str,
+    account: str,
+    context: Dict[str, Optional[str]],
+    parameters: Optional[Dict[str, str]] = None,
+    multi: bool = False,
+) -> List[Tuple]:
+    """
+    runs `sql` and returns its rows. `context` holds the database, schema, role and
+    warehouse to run it with. With `multi`, `sql` may hold several statements and the
+    rows of all of them are returned, in order.
+    """
+    body = {
+        "statement": sql,
+        "timeout": STATEMENT_TIMEOUT_SECONDS,
+        **{k: v for k, v in context.items() if v},
+        "parameters": dict(
+            parameters or {}, MULTI_STATEMENT_COUNT="0" if multi else "1"
+        ),
+    }
+    query = urlencode({"requestId": str(uuid.uuid4()), "async": "true"})
+    result = wait(
+        account, *request(account, "POST", f"{STATEMENTS_PATH}?{query}", body)
+    )
+    handles = result.get("statementHandles")
+    if not handles:
+        return result_rows(account, result)
+    rows = []
+    for handle in handles:
+        status, body = request(account, "GET", f"{STATEMENTS_PATH}/{handle}")
+        rows.extend(result_rows(account, wait(account, status, body)))
+    return rows
@@ -0,0 +1,68 @@
+import logging
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Dict, Iterable, Tuple
+
+import profiler
+
+logger = logging.getLogger(__name__)
+
+
+class Scheduler:
+    """
+    Runs scrape tasks as soon as the tasks they depend on are done, sharing one
+    pool of `max_workers` threads. A task gets the results of its dependencies as
+    extra positional arguments, after its own args. Tasks may add more tasks while
+    they run (e.g. one task per database once the database names are known).
+    """
+
+    def __init__(self, max_workers: int = 8):
+        self.max_workers = max_workers
+        self.lock = threading.Lock()
+        self.pending: Dict[str, Tuple[Callable, tuple, Tuple[str, ...]]] = {}
+        self.results: Dict[str, object] = {}
+
+    def add(self, name: str, fn: Callable, *args, deps: Iterable[str] = ()) -> str:
+        with self.lock:
+            if name in self.pending or name in self.results:
+                raise ValueError(f"Task {name} was already added")
+            self.pending[name] = (fn, args, tuple(deps))
+        return name
+
+    def _run_task(self, name: str, fn: Callable, args: tuple):
+        with profiler.phase(name):
+            return fn(*args)
+
+    def run(self) -> Dict[str, object]:
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while True:
+                with self.lock:
+                    ready = [
+                        name
+                        for name, (_, _, deps) in self.pending.items()
+                        if all(dep in self.results for dep in deps)
+                    ]
+                    for name in ready:
+                        fn, args, deps = self.pending.pop(name)
+                        dep_results = tuple(self.results[dep] for dep in deps)
+                        future = executor.submit(
+                            self._run_task, name, fn, args + dep_results
+                        )
+                        running[future] = name
+                if not running:
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception:
+                        logger.exception(f"Task {name} failed")
+                        executor.shutdown(wait=True, cancel_futures=True)
+                        raise
+                    with self.lock:
+                        self.results[name] = result
+        if self.pending:
+            raise ValueError(f"Unsatisfiable dependencies: {sorted(self.pending)}")
+        return self.results
@@ -0,0 +1,176 @@
+"""
+A local stand-in of the Snowflake SQL API, to run rest_transport.py against
+without an account:
+
+    python terraformer/sql_api_stub.py --port 8080 --results results.json
+    SNOWFLAKE_SQL_API_URL=http://127.0.0.1:8080 SNOWFLAKE_OAUTH_TOKEN=x \
+        SNOWFLAKE_TRANSPORT=rest python terraformer/terraformer.py ...
+
+Statements are answered from canned results, `{sql: {"rowType": [...], "data": [...]}}`
+with the values as strings like the real API returns them. Every statement is
+reported as running (202) for `polls` polls before it finishes, results are split
+into partitions of `partition_size` rows, and a request with several statements
+(MULTI_STATEMENT_COUNT=0) gets one statement handle per statement. Unknown SQL
+fails like a compilation error (422).
+"""
+
+import argparse
+import json
+import threading
+import uuid
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs, urlparse
+
+from rest_transport import STATEMENTS_PATH
+
+
+class SqlApiStub:
+    def __init__(
+        self,
+        results: Dict[str, dict],
+        polls: int = 1,
+        partition_size: int = 2,
+        port: int = 0,
+    ):
+        self.results = results
+        self.polls = polls
+        self.partition_size = partition_size
+        self.lock = threading.Lock()
+        # handle -> {"polls_left", "sql", "handles" (of a multi-statement request)}
+        self.statements: Dict[str, dict] = {}
+        # every (method, path) served, in order
+        self.requests: List[tuple] = []
+        # client ports seen, one per keep-alive connection
+        self.connections = set()
+        handler = type("Handler", (StubHandler,), {"stub": self})
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def start(self) -> "SqlApiStub":
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def submit(self, sql: str, multi: bool) -> str:
+        handle = str(uuid.uuid4())
+        if multi:
+            statements = [stmt.strip() for stmt in sql.split(";") if stmt.strip()]
+            handles = [self.submit(stmt, False) for stmt in statements]
+            statement = {"polls_left": self.polls, "handles": handles}
+        else:
+            statement = {"polls_left": self.polls, "sql": sql}
+        with self.lock:
+            self.statements[handle] = statement
+        return handle
+
+    def poll(self, handle: str, partition: Optional[int]):
+        # (status, body) of a statement, counting down its polls
+        with self.lock:
+            statement = self.statements.get(handle)
+            if statement is None:
+                return HTTPStatus.NOT_FOUND, {"message": f"no statement {handle}"}
+            if statement["polls_left"]:
+                statement["polls_left"] -= 1
+                return HTTPStatus.ACCEPTED, {
+                    "statementHandle": handle,
+                    "message": "Asynchronous execution in progress.",
+                }
+        if "handles" in statement:
+            return HTTPStatus.OK, {
+                "statementHandle": handle,
+                "statementHandles": statement["handles"],
+                "message": "Statement executed successfully.",
+            }
+        result = self.results.get(statement["sql"].rstrip(";").strip())
+        if result is None:
+            return HTTPStatus.UNPROCESSABLE_ENTITY, {
+                "code": "002003",
+                "sqlState": "02000",
+                "message": "SQL compilation error: Object does not exist.",
+                "statementHandle": handle,
+            }
+        data = result["data"]
+        partitions = [
+            data[i : i + self.partition_size]
+            for i in range(0, len(data), self.partition_size)
+        ] or [[]]
+        if partition:
+            return HTTPStatus.OK, {"data": partitions[partition]}
+        return HTTPStatus.OK, {
+            "statementHandle": handle,
+            "resultSetMetaData": {
+                "numRows": len(data),
+                "rowType": result["rowType"],
+                "partitionInfo": [{"rowCount": len(rows)} for rows in partitions],
+            },
+            "data": partitions[0],
+        }
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1, so clients can keep the connection alive
+    protocol_version = "HTTP/1.1"
+    stub: SqlApiStub
+
+    def log_message(self, format, *args):
+        pass
+
+    def send(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def record(self):
+        with self.stub.lock:
+            self.stub.requests.append((self.command, self.path))
+            self.stub.connections.add(self.client_address[1])
+
+    def do_POST(self):
+        self.record()
+        url = urlparse(self.path)
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        if url.path != STATEMENTS_PATH:
+            return self.send(HTTPStatus.NOT_FOUND, {"message": url.path})
+        if not self.headers.get("Authorization", "").startswith("Bearer "):
+            return self.send(HTTPStatus.UNAUTHORIZED, {"message": "no token"})
+        multi = body.get("parameters", {}).get("MULTI_STATEMENT_COUNT") == "0"
+        handle = self.stub.submit(body["statement"], multi)
+        self.send(*self.stub.poll(handle, None))
+
+    def do_GET(self):
+        self.record()
+        url = urlparse(self.path)
+        if not url.path.startswith(STATEMENTS_PATH + "/"):
+            return self.send(HTTPStatus.NOT_FOUND, {"message": url.path})
+        params = {k: v[0] for k, v in parse_qs(url.query).items()}
+        partition = int(params["partition"]) if "partition" in params else None
+        handle = url.path[len(STATEMENTS_PATH) + 1 :]
+        self.send(*self.stub.poll(handle, partition))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--results", help="JSON file of {sql: {rowType, data}}")
+    parser.add_argument("--polls", type=int, default=1)
+    parser.add_argument("--partition_size", type=int, default=1000)
+    args = parser.parse_args()
+
+    results = {}
+    if args.results:
+        with open(args.results) as f:
+            results = json.load(f)
+    stub = SqlApiStub(results, args.polls, args.partition_size, args.port)
+    print(f"SQL API stub listening on {stub.url}")
+    stub.server.serve_forever()
@@ -1,4 +1,5 @@
 import client as snowflake_client
+import resources
 from resources import (
     SnowflakeDatabase,
     SnowflakeStage,
@@ -7,12 +8,35 @@ from resources import (
     SnowflakeSchema,
     SnowflakePipe,
     SnowflakeFileFormat,
+    SnowflakeTable,
+    SnowflakeView,
 )
-import python_terraform
 import argparse
+import collections
+import contextlib
+import itertools
+import json
 import os
+import threading
+import time
+import types
+from concurrent.futures import ProcessPoolExecutor
 import logging
 import data_parse_helper as dph
+import profiler
+from tfstate import STATE_FILENAME, StateBuilder, load_provider_schema
+from inventory import Inventory
+from journal import Journal
+from scheduler import Scheduler
+
+IMPORT_FILENAME = "generated_tf_snowflake_import_resources.sh"
+
+# Collects every written resource when a terraform.tfstate should be synthesized
+state_builder = None
+# Local SQLite store that every scraped resource is persisted to, see inventory.py
+inventory = None
+# Durable record of the units of work a scrape finished, see journal.py
+journal = None
 
 
 def getLogger(level=logging.INFO):
@@ -21,23 +45,168 @@ def getLogger(level=logging.INFO):
     return logger
 
 
+# Number of resources written (or excluded) per resource type, for the run summary
+resource_counts = collections.Counter()
+resource_counts_lock = threading.Lock()
+
+
+def write_resource(t, resource):
+    # writes the terraform code and import command of a scraped resource
+    resource.append_tf_code_to_file(t.working_dir)
+    resource.append_import_command_to_file(
+        file_dir=t.import_dir, filename=IMPORT_FILENAME
+    )
+    # a unit of work collects its own state, it is only kept if the unit finishes
+    builder = getattr(t, "state_builder", state_builder)
+    if builder is not None:
+        builder.add(resource)
+    if inventory is not None:
+        inventory.add(resource, unit=getattr(t, "unit", None))
+    with resource_counts_lock:
+        if resource.excluded:
+            resource_counts["excluded"] += 1
+        else:
+            resource_counts[resource.snowflake_provider_resource] += 1
+
+
+def run_unit(t, unit, fn, *args):
+    """
+    runs a unit of work (a phase, or a phase for one database) into its own staging
+    directory, and commits what it wrote to t's files through the journal. A unit
+    finished by the run being resumed is skipped, and its journaled result returned.
+    A unit that fails is recorded and returns None, so the rest of the run goes on.
+    """
+    if journal.is_done(unit):
+        logging.info(f"Skipping {unit}, it finished in the resumed run")
+        if state_builder is not None:
+            state_builder.resources.extend(journal.state(unit))
+        return journal.result(unit)
+    staging_dir = journal.staging_dir(unit)
+    unit_t = types.SimpleNamespace(
+        working_dir=staging_dir,
+        import_dir=staging_dir,
+        unit=unit,
+        state_builder=(
+            StateBuilder(state_builder.provider_schema) if state_builder else None
+        ),
+    )
+    if inventory is not None:
+        # rows of an earlier attempt that was interrupted
+        inventory.discard_unit(unit)
+    try:
+        result = fn(unit_t, *args)
+    except Exception as e:
+        logging.exception(f"{unit} failed, continuing with the rest of the run")
+        resources.close_outputs(staging_dir)
+        if inventory is not None:
+            inventory.discard_unit(unit)
+        journal.fail(unit, staging_dir, e)
+        return None
+    resources.close_outputs(staging_dir)
+    if inventory is not None:
+        inventory.commit()
+    # journaled absolute, a resumed run may be started from another directory
+    targets = {
+        filename: os.path.abspath(
+            os.path.join(
+                t.import_dir if filename == IMPORT_FILENAME else t.working_dir,
+                filename,
+            )
+        )
+        for filename in os.listdir(staging_dir)
+    }
+    unit_state = unit_t.state_builder.resources if unit_t.state_builder else None
+    journal.commit(unit, staging_dir, targets, result=result, state=unit_state)
+    if unit_state:
+        state_builder.resources.extend(unit_state)
+    return result
+
+
+def tf_from_inventory(t, store):
+    ## OFFLINE
+    # Render everything from a previous scrape's inventory, without Snowflake.
+    #   Excluded resources are included so they are logged like in a scrape.
+    for resource in store.resources(include_excluded=True):
+        write_resource(t, resource)
+
+
+def render_file(inventory_path, tf_filename, working_dir, output_format, schema):
+    """
+    renders every resource of one output file from the inventory, and writes the
+    file in one go. Runs in a worker process of render_files, so the rendering
+    isn't bound to a single core. Returns the file's import lines, resource counts
+    and, with a provider `schema` (None when no state is synthesized), its state
+    entries.
+    """
+    resources.OUTPUT_FORMAT = output_format
+    store = Inventory(inventory_path)
+    builder = StateBuilder(schema) if schema is not None else None
+    blocks, import_lines, counts = [], [], collections.Counter()
+    for resource in store.resources(tf_filename=tf_filename, include_excluded=True):
+        if resource.excluded:
+            # only logs that it won't be managed, like in write_resource
+            resource.append_tf_code_to_file()
+            counts["excluded"] += 1
+            continue
+        if output_format == "json":
+            blocks.append(resource.tf_json())
+        else:
+            blocks.append(resource.tf_code() + "\n\n")
+        import_lines.append(resource.tf_import_string + "\n")
+        counts[resource.snowflake_provider_resource] += 1
+        if builder is not None:
+            builder.add(resource)
+    store.close()
+    if output_format == "json" and blocks:
+        writer = resources.TfJsonWriter(
+            os.path.join(working_dir, tf_filename + ".json")
+        )
+        for block in blocks:
+            writer.write(block)
+        writer.close()
+    elif blocks:
+        with open(os.path.join(working_dir, tf_filename), "a+") as f:
+            f.write("".join(blocks))
+    return import_lines, counts, builder.resources if builder else []
+
+
+def render_files(t, inventory_path, output_format, workers):
+    ## OFFLINE, SHARDED
+    # Render an inventory with a pool of processes, one output file per task.
+    #   The import lines are written once all files are done, in file order.
+    store = Inventory(inventory_path)
+    tf_filenames = store.tf_filenames()
+    store.close()
+    schema = state_builder.provider_schema if state_builder is not None else None
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(
+                render_file,
+                inventory_path,
+                tf_filename,
+                t.working_dir,
+                output_format,
+                schema,
+            )
+            for tf_filename in tf_filenames
+        ]
+        results = [future.result() for future in futures]
+    with open(os.path.join(t.import_dir, IMPORT_FILENAME), "a+") as f:
+        for import_lines, counts, state in results:
+            f.writelines(import_lines)
+            resource_counts.update(counts)
+            if state_builder is not None:
+                state_builder.resources.extend(state)
+
+
 def tf_databases(t):
     ## DATABASES
     # Get database info from snowflake, write an outline to terraform files,
     #   and run `terraform import` on each resource.
-    db_data = snowflake_client.exec_sql_multi("show databases")
-    columns = [
-        "created_on",
-        "name",
-        "is_default",
-        "is_current",
-        "origin",
-        "owner",
-        "comment",
-        "options",
-        "retention_time",
-    ]
-    db_dicts = [{k: row[i] for i, k in enumerate(columns)} for row in db_data]
+    columns = ["name", "owner", "comment"]
+    db_dicts = list(
+        snowflake_client.iter_show("show databases", columns, paginate=True)
+    )
     database_names = [db["name"] for db in db_dicts]
     for row in db_dicts:
         tfDatabase = SnowflakeDatabase(
@@ -45,65 +214,78 @@ def tf_databases(t):
             regex_exclusion_rules=regex_exclusion_rules,
             **row,
         )
-        tfDatabase.append_tf_code_to_file(file_dir=t.working_dir)
-        tfDatabase.append_import_command_to_file(
-            filename="generated_tf_snowflake_import_resources.sh"
-        )
+        write_resource(t, tfDatabase)
     return database_names
 
 
+def tf_schemas_in_database(t, db):
+    # We may want to separate tf files by database. Returns the names of the
+    #   schemas that are managed (written and not excluded), tf_tables and tf_views
+    #   only scrape those.
+    columns = ["name", "database_name", "owner", "comment"]
+    schema_dicts = list(
+        snowflake_client.iter_show(
+            f"show schemas in database {db}", columns, paginate=True
+        )
+    )
+    managed_schemas = []
+    for schema in schema_dicts:
+        print("'" + schema["database_name"] + "'")
+        if schema["database_name"] == "RAW":
+            if any(
+                [x in schema["name"] for x in ["PUBLIC", "KINESIS_", "CHARM_EXTERNAL"]]
+            ):
+                # Special inclusion rules only for RAW DB to exclude Stitch schemas.
+                # only process if it's `public`, `kinesis_*`, or `charm_external`
+                # There isn't a clear way to make an exclusion rule for Stitch :(
+                tfSchema = SnowflakeSchema(
+                    attr_exclusion_rules=attr_exclusion_rules,
+                    regex_exclusion_rules=regex_exclusion_rules,
+                    **schema,
+                )
+                write_resource(t, tfSchema)
+                if not tfSchema.excluded:
+                    managed_schemas.append(schema["name"])
+        else:
+            # Otherwise proceed as normal
+            tfSchema = SnowflakeSchema(**schema)
+            write_resource(t, tfSchema)
+            if not tfSchema.excluded:
+                managed_schemas.append(schema["name"])
+    return managed_schemas
+
+
 def tf_schemas(t, database_names):
     ## SCHEMAS
     # Iterate through all the existing databases, get all the schemas, and turn
     #   them into terraform resources.
-    database_schemas = {}
-    for db in database_names:
-        # We may want to separate tf files by database
-        schema_data = snowflake_client.exec_sql_multi(f"show schemas in database {db}")
-        columns = [
-            "created_on",
-            "name",
-            "is_default",
-            "is_current",
-            "database_name",
-            "owner",
-            "comment",
-            "options",
-            "retention_time",
-        ]
-        schema_dicts = [
-            {k: row[i] for i, k in enumerate(columns)} for row in schema_data
-        ]
-        database_schemas[db] = [schema["name"] for schema in schema_dicts]
-        for schema in schema_dicts:
-            print("'" + schema["database_name"] + "'")
-            if schema["database_name"] == "RAW":
-                if any(
-                    [
-                        x in schema["name"]
-                        for x in ["PUBLIC", "KINESIS_", "CHARM_EXTERNAL"]
-                    ]
-                ):
-                    # Special inclusion rules only for RAW DB to exclude Stitch schemas.
-                    # only process if it's `public`, `kinesis_*`, or `charm_external`
-                    # There isn't a clear way to make an exclusion rule for Stitch :(
-                    tfSchema = SnowflakeSchema(
-                        attr_exclusion_rules=attr_exclusion_rules,
-                        regex_exclusion_rules=regex_exclusion_rules,
-                        **schema,
-                    )
-                    tfSchema.append_tf_code_to_file(t.working_dir)
-                    tfSchema.append_import_command_to_file(
-                        filename="generated_tf_snowflake_import_resources.sh"
-                    )
-            else:
-                # Otherwise proceed as normal
-                tfSchema = SnowflakeSchema(**schema)
-                tfSchema.append_tf_code_to_file(t.working_dir)
-                tfSchema.append_import_command_to_file(
-                    filename="generated_tf_snowflake_import_resources.sh"
-                )
-    return database_schemas
+    return {db: tf_schemas_in_database(t, db) for db in database_names}
+
+
+def tf_stages_in_database(t, database):
+    # NOTE: We may want to separate schema.tf files by database
+    columns = [
+        "name",
+        "database_name",
+        "schema_name",
+        "url",
+        "owner",
+        "comment",
+        "storage_integration",
+    ]
+    query = f"show stages in database {database}"
+    for row in snowflake_client.iter_show(query, columns):
+        stage_extra_data = snowflake_client.exec_sql_multi(
+            f"desc stage {database}.{row['schema_name']}.{row['name']}"
+        )
+        stage_dict = dph.stage_parser(stage_extra_data)
+        tfStage = SnowflakeStage(
+            attr_exclusion_rules=attr_exclusion_rules,
+            regex_exclusion_rules=regex_exclusion_rules,
+            extra_data=stage_dict,
+            **row,
+        )
+        write_resource(t, tfStage)
 
 
 def tf_stages(t, database_names):
@@ -111,144 +293,57 @@ def tf_stages(t, database_names):
     #  Iterate through every database, looking at the `information_schema` schema
     # NOTE: We probably want to avoid special autoschemas, like `information_schema`
     for database in database_names:
-        # NOTE: We may want to separate schema.tf files by database
-        columns = [
-            "created_on",
-            "name",
-            "database_name",
-            "schema_name",
-            "url",
-            "has_credentials",
-            "has_encryption_key",
-            "owner",
-            "comment",
-            "region",
-            "type",
-            "cloud",
-            "notification_channel",
-            "storage_integration",
-        ]
-        query = f"show stages in database {database}"
-        snowflake_client.DATABASE = database
-        stage_data = snowflake_client.exec_sql_multi(query)
-        stage_dicts = [{k: row[i] for i, k in enumerate(columns)} for row in stage_data]
-        for row in stage_dicts:
-            stage_extra_data = snowflake_client.exec_sql_multi(
-                f"desc stage {database}.{row['schema_name']}.{row['name']}"
-            )
-            stage_dict = dph.stage_parser(stage_extra_data)
-            tfStage = SnowflakeStage(
-                attr_exclusion_rules=attr_exclusion_rules,
-                regex_exclusion_rules=regex_exclusion_rules,
-                extra_data=stage_dict,
-                **row,
-            )
-            tfStage.append_tf_code_to_file(t.working_dir)
-            tfStage.append_import_command_to_file(
-                filename="generated_tf_snowflake_import_resources.sh"
-            )
+        tf_stages_in_database(t, database)
+
+
+def tf_file_format_in_database(t, database):
+    # scoped to the database explicitly, so databases can be scraped concurrently
+    query = f"show file formats in database {database}"
+    columns = [
+        "name",
+        "database_name",
+        "schema_name",
+        "type",
+        "owner",
+        "comment",
+        "format_options",
+    ]
+    for row in snowflake_client.iter_show(query, columns):
+        tfFileFormat = SnowflakeFileFormat(
+            attr_exclusion_rules=attr_exclusion_rules,
+            regex_exclusion_rules=regex_exclusion_rules,
+            **row,
+        )
+        write_resource(t, tfFileFormat)
 
 
 def tf_file_format(t, database_names):
     ## FILE_FORMATS
-    #  Iterate through every database, looking at the `information_schema` schema
-    #  and grabbing the `file_format` table.
+    #  Iterate through every database and grab its file formats
     for database in database_names:
-        query = f"show file formats"
-        snowflake_client.DATABASE = database
-        file_format_data = snowflake_client.exec_sql_multi(query)
-        columns = [
-            "created_on",
-            "name",
-            "database_name",
-            "schema_name",
-            "type",
-            "owner",
-            "comment",
-            "format_options",
-        ]
-        file_format_dicts = [
-            {k: row[i] for i, k in enumerate(columns)} for row in file_format_data
-        ]
-        for row in file_format_dicts:
-            tfFileFormat = SnowflakeFileFormat(
-                attr_exclusion_rules=attr_exclusion_rules,
-                regex_exclusion_rules=regex_exclusion_rules,
-                **row,
-            )
-            tfFileFormat.append_tf_code_to_file(t.working_dir)
-            tfFileFormat.append_import_command_to_file(
-                filename="generated_tf_snowflake_import_resources.sh"
-            )
+        tf_file_format_in_database(t, database)
 
 
 def tf_warehouses(t):
     ## WAREHOUSES
-    wh_data = snowflake_client.exec_sql_multi("show warehouses")
+    # the cluster counts and scaling policy are missing from Standard edition
     columns = [
         "name",
-        "state",
-        "type",
         "size",
         "min_cluster_count",
         "max_cluster_count",
-        "started_clusters",
-        "running",
-        "queued",
-        "is_default",
-        "is_current",
         "auto_suspend",
         "auto_resume",
-        "available",
-        "provisioning",
-        "quiescing",
-        "other",
-        "created_on",
-        "resumed_on",
-        "updated_on",
         "owner",
         "comment",
-        "resource_monitor",
-        "actives",
-        "pendings",
-        "failed",
-        "suspended",
-        "uuid",
         "scaling_policy",
     ]
-    columns_wo_cluster = [
-        "name",
-        "state",
-        "type",
-        "size",
-        "running",
-        "queued",
-        "is_default",
-        "is_current",
-        "auto_suspend",
-        "auto_resume",
-        "available",
-        "provisioning",
-        "quiescing",
-        "other",
-        "created_on",
-        "resumed_on",
-        "updated_on",
-        "owner",
-        "comment",
-        "resource_monitor",
-        "actives",
-        "pendings",
-        "failed",
-        "suspended",
-        "uuid",
-    ]
-    try:
-        wh_dicts = [{k: row[i] for i, k in enumerate(columns)} for row in wh_data]
-    except IndexError:
-        wh_dicts = [{k: row[i] for i, k in enumerate(columns_wo_cluster)} for row in wh_data]
+    wh_dicts = list(snowflake_client.iter_show("show warehouses", columns))
 
     for row in wh_dicts:
+        for count in ["min_cluster_count", "max_cluster_count"]:
+            if row[count] is None:
+                row[count] = 1
         addtl_params = snowflake_client.exec_sql_multi(
             f"show parameters in warehouse {row['name']};"
         )
@@ -263,56 +358,192 @@ def tf_warehouses(t):
             regex_exclusion_rules=regex_exclusion_rules,
             **row,
         )
-        tfWarehouse.append_tf_code_to_file(t.working_dir)
-        tfWarehouse.append_import_command_to_file(
-            filename="generated_tf_snowflake_import_resources.sh"
-        )
+        write_resource(t, tfWarehouse)
 
 
 def tf_roles(t):
     ## ROLES
-    role_data = snowflake_client.exec_sql_multi("show roles")
-    columns = [
-        "created_on",
-        "name",
-        "is_default",
-        "is_current",
-        "is_inherited",
-        "assigned_to_users",
-        "granted_to_roles",
-        "granted_roles",
-        "owner",
-        "comment",
-    ]
-    role_dicts = [{k: row[i] for i, k in enumerate(columns)} for row in role_data]
+    columns = ["name", "owner", "comment"]
+    role_dicts = snowflake_client.iter_show("show roles", columns)
     for row in role_dicts:
         tfRole = SnowflakeRole(
             attr_exclusion_rules=attr_exclusion_rules,
             regex_exclusion_rules=regex_exclusion_rules,
             **row,
         )
-        tfRole.append_tf_code_to_file(t.working_dir)
-        tfRole.append_import_command_to_file(
-            filename="generated_tf_snowflake_import_resources.sh"
+        write_resource(t, tfRole)
+
+
+def show_pipes(database):
+    # `show pipes` runs in the cloud-services layer, unlike information_schema.pipes.
+    #   Rename its columns to the information_schema names SnowflakePipe expects.
+    columns = {
+        "name": "pipe_name",
+        "database_name": "pipe_catalog",
+        "schema_name": "pipe_schema",
+        "definition": "definition",
+        "owner": "pipe_owner",
+        "notification_channel": "notification_channel_name",
+        "comment": "comment",
+    }
+    pipe_data = snowflake_client.iter_show(
+        f"show pipes in database {database}", list(columns)
+    )
+    pipe_dicts = [{columns[k]: v for k, v in row.items()} for row in pipe_data]
+    for row in pipe_dicts:
+        auto_ingest = bool(row["notification_channel_name"])
+        row["is_autoingest_enabled"] = "YES" if auto_ingest else "NO"
+    return pipe_dicts
+
+
+def tf_pipes_in_database(t, database):
+    if snowflake_client.METADATA_ONLY:
+        pipe_dicts = show_pipes(database)
+    else:
+        query = f"select * from {database}.information_schema.pipes"
+        pipe_data = snowflake_client.query_to_df(query)
+        pipe_dicts = [dict(row) for _, row in pipe_data.iterrows()]
+    for row in pipe_dicts:
+        tfPipe = SnowflakePipe(
+            attr_exclusion_rules=attr_exclusion_rules,
+            regex_exclusion_rules=regex_exclusion_rules,
+            **row,
         )
+        write_resource(t, tfPipe)
 
 
 def tf_pipes(t, database_names):
     ## PIPES
     for database in database_names:
-        snowflake_client.DATABASE = database
-        query = f"select * from {database}.information_schema.pipes"
-        pipe_data = snowflake_client.query_to_df(query)
-        for _, row in pipe_data.iterrows():
-            tfPipe = SnowflakePipe(
+        tf_pipes_in_database(t, database)
+
+
+def tf_tables_in_database(t, database, schema_names):
+    ## TABLES
+    # Tables are by far the largest population, so columns are streamed in Arrow
+    #   batches and grouped into their table on the fly: only one table is held in
+    #   memory at a time and it is written out as soon as its last column arrives.
+    # One query per managed schema: information_schema fails a query over a whole
+    #   large database with "Information schema query returned too much data",
+    #   and excluded schemas (e.g. dated airflow ones) aren't queried at all.
+    if schema_names is None:
+        raise ValueError(f"The schemas of {database} weren't scraped")
+    for schema in schema_names:
+        tf_tables_in_schema(t, database, schema)
+
+
+def tf_tables_in_schema(t, database, schema):
+    schema_literal = schema.replace("'", "''")
+    query = f"""
+        select
+            c.table_catalog,
+            c.table_schema,
+            c.table_name,
+            t.table_owner,
+            t.comment,
+            t.clustering_key,
+            c.column_name,
+            c.data_type,
+            c.character_maximum_length,
+            c.numeric_precision,
+            c.numeric_scale,
+            c.datetime_precision,
+            c.is_nullable,
+            c.comment as column_comment
+        from {database}.information_schema.columns c
+        join {database}.information_schema.tables t
+            on t.table_schema = c.table_schema and t.table_name = c.table_name
+        where t.table_type = 'BASE TABLE'
+            and c.table_schema = '{schema_literal}'
+            and t.table_schema = '{schema_literal}'
+        order by c.table_name, c.ordinal_position
+    """
+    rows = itertools.chain.from_iterable(snowflake_client.iter_sql_batches(query))
+    for table in dph.group_table_columns(rows):
+        tfTable = SnowflakeTable(
+            attr_exclusion_rules=attr_exclusion_rules,
+            regex_exclusion_rules=regex_exclusion_rules,
+            **table,
+        )
+        write_resource(t, tfTable)
+
+
+def tf_views_in_database(t, database, schema_names):
+    ## VIEWS
+    # only the views of managed schemas, one query per schema like tf_tables
+    if schema_names is None:
+        raise ValueError(f"The schemas of {database} weren't scraped")
+    for schema in schema_names:
+        tf_views_in_schema(t, database, schema)
+
+
+def tf_views_in_schema(t, database, schema):
+    schema_literal = schema.replace("'", "''")
+    query = f"""
+        select
+            table_catalog,
+            table_schema,
+            table_name,
+            table_owner,
+            comment,
+            is_secure,
+            view_definition
+        from {database}.information_schema.views
+        where table_schema = '{schema_literal}'
+    """
+    for batch in snowflake_client.iter_sql_batches(query):
+        for row in batch:
+            tfView = SnowflakeView(
                 attr_exclusion_rules=attr_exclusion_rules,
                 regex_exclusion_rules=regex_exclusion_rules,
-                **dict(row),
-            )
-            tfPipe.append_tf_code_to_file(t.working_dir)
-            tfPipe.append_import_command_to_file(
-                filename="generated_tf_snowflake_import_resources.sh"
+                **row,
             )
+            write_resource(t, tfView)
+
+
+# Phases that run once per database, once the database names are known
+DATABASE_PHASES = {
+    "tf_file_format": tf_file_format_in_database,
+    "tf_schemas": tf_schemas_in_database,
+    "tf_stages": tf_stages_in_database,
+    "tf_pipes": tf_pipes_in_database,
+}
+
+# Opt-in with --tables, these read information_schema and need a warehouse
+TABLE_PHASES = {
+    "tf_tables": tf_tables_in_database,
+    "tf_views": tf_views_in_database,
+}
+
+# Per-database phases that get the result of another phase of the same database,
+#   tf_tables and tf_views query the managed schemas one by one
+PHASE_DEPS = {"tf_tables": "tf_schemas", "tf_views": "tf_schemas"}
+
+
+def schedule_phases(scheduler, t, tables=False):
+    """
+    adds every scrape phase to the scheduler. Only the per-database phases depend on
+    tf_databases, so warehouses are scraped while databases are listed, and each
+    database's phases start as soon as the database names are known (tf_tables and
+    tf_views also wait for the database's schemas, see PHASE_DEPS). Every phase runs as a unit
+    of work of the journal, see run_unit.
+    """
+    phases = dict(DATABASE_PHASES, **(TABLE_PHASES if tables else {}))
+
+    def schedule_database_phases(database_names):
+        # None when tf_databases failed
+        for database in database_names or []:
+            for phase, fn in phases.items():
+                unit = f"{phase}:{database}"
+                dep = PHASE_DEPS.get(phase)
+                deps = [f"{dep}:{database}"] if dep else []
+                scheduler.add(unit, run_unit, t, unit, fn, database, deps=deps)
+
+    scheduler.add("tf_databases", run_unit, t, "tf_databases", tf_databases)
+    scheduler.add("tf_warehouses", run_unit, t, "tf_warehouses", tf_warehouses)
+    scheduler.add(
+        "schedule_database_phases", schedule_database_phases, deps=["tf_databases"]
+    )
 
 
 ## EXCLUSIONS:
@@ -346,20 +577,237 @@ regex_exclusion_rules = {
     SnowflakeDatabase: ["^snowflake$", "snowflake_sample_data"],
 }
 
+
+def run(t, args):
+    """
+    scrapes Snowflake (or renders --from_inventory) into t.working_dir, with the
+    options of the command line. Returns a summary of the run.
+    """
+    global state_builder, inventory, journal
+    state_path = os.path.join(t.working_dir, STATE_FILENAME)
+    if args.synthesize_state and os.path.exists(state_path):
+        # checked before scraping anything, the state is only written at the end
+        raise FileExistsError(f"{state_path} already exists, move it out of the way")
+    start = time.time()
+    # a long-running process (see daemon.py) calls this once per refresh
+    state_builder = inventory = journal = None
+    resource_counts.clear()
+    snowflake_client.compute_statements.clear()
+    snowflake_client.METADATA_ONLY = args.metadata_only
+    resources.OUTPUT_FORMAT = args.output_format
+    if args.synthesize_state:
+        state_builder = StateBuilder(
+            load_provider_schema(args.provider_schema) if args.provider_schema else None
+        )
+    if args.profile:
+        profiler.enable(args.profile)
+
+    try:
+        if args.from_inventory:
+            if args.render_workers > 1:
+                with profiler.phase("render_files"):
+                    render_files(
+                        t, args.from_inventory, args.output_format, args.render_workers
+                    )
+            else:
+                store = Inventory(args.from_inventory)
+                with profiler.phase("tf_from_inventory"):
+                    tf_from_inventory(t, store)
+                store.close()
+        else:
+            if args.inventory:
+                inventory = Inventory(args.inventory)
+            journal = Journal(t.working_dir, resume=args.resume)
+            # one thread per statement the adaptive limit may allow, so the limit
+            #   rather than the pool decides how many statements run at once
+            snowflake_client.limiter = snowflake_client.AdaptiveLimiter(
+                maximum=args.workers
+            )
+            scheduler = Scheduler(max_workers=args.workers)
+            schedule_phases(scheduler, t, tables=args.tables)
+            scheduler.run()
+            journal.close()
+            if inventory is not None:
+                inventory.close()
+    finally:
+        resources.close_outputs()
+
+    if state_builder is not None and journal and journal.failed:
+        logging.warning("Not writing terraform.tfstate, --resume writes it complete")
+    elif state_builder is not None:
+        state_builder.write(t.working_dir)
+    if args.profile:
+        print(profiler.summary())
+        profiler.write()
+
+    return {
+        "resources": dict(resource_counts),
+        "compute_statements": list(snowflake_client.compute_statements),
+        "seconds": time.time() - start,
+        "failed_units": dict(journal.failed) if journal else {},
+    }
+
+
+def scrape_account(account, args):
+    """
+    runs in its own worker process for every account of --accounts, so each account
+    gets its own client configuration. Everything it writes goes to
+    <tf_dir>/<account name>, including the import script, inventory and profile.
+    """
+    name = account["name"]
+    output_dir = os.path.join(os.path.abspath(args.tf_dir), name)
+    os.makedirs(output_dir, exist_ok=True)
+    # e.g. SNOWFLAKE_PRIVATE_KEY_PATH, for accounts with their own credentials
+    os.environ.update(account.get("env", {}))
+    snowflake_client.configure(
+        **{
+            k: account[k]
+            for k in ["account", "warehouse", "database", "role", "schema", "transport"]
+            if k in account
+        }
+    )
+    account_args = argparse.Namespace(**vars(args))
+    for option in ["inventory", "from_inventory", "profile"]:
+        if getattr(args, option):
+            # only the name, an absolute path would be shared by every account
+            name_only = os.path.basename(os.path.normpath(getattr(args, option)))
+            setattr(account_args, option, os.path.join(output_dir, name_only))
+
+    t = types.SimpleNamespace(working_dir=output_dir, import_dir=output_dir)
+    try:
+        return dict(run(t, account_args), account=name)
+    except Exception as e:
+        logging.exception(f"Scraping account {name} failed")
+        return {"account": name, "error": repr(e)}
+
+
+def scrape_accounts(accounts, args):
+    # one worker process per account, so the total time is the slowest account's.
+    #   Each account gets a pool of its own: a shared pool reuses a worker process
+    #   for the next account, which would inherit the env and client settings.
+    with contextlib.ExitStack() as stack:
+        futures = [
+            stack.enter_context(ProcessPoolExecutor(max_workers=1)).submit(
+                scrape_account, account, args
+            )
+            for account in accounts
+        ]
+        return [future.result() for future in futures]
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     this_dir = os.path.dirname(os.path.realpath(__file__))
     parser.add_argument("--tf_dir", default=os.path.join(this_dir, "../snowflake"))
+    parser.add_argument(
+        "--accounts",
+        help="JSON config of several accounts to scrape concurrently, see README",
+    )
+    parser.add_argument(
+        "--metadata_only",
+        action="store_true",
+        help="connect without a warehouse and only run SHOW/DESC commands",
+    )
+    parser.add_argument(
+        "--output_format",
+        choices=["hcl", "json"],
+        default="hcl",
+        help="write HCL (.tf) or Terraform JSON (.tf.json) files",
+    )
+    parser.add_argument(
+        "--synthesize_state",
+        action="store_true",
+        help="write terraform.tfstate directly instead of relying on the imports",
+    )
+    parser.add_argument(
+        "--provider_schema",
+        help="output of `terraform providers schema -json`, used with --synthesize_state",
+    )
+    parser.add_argument(
+        "--tables",
+        action="store_true",
+        help="also scrape tables and views (needs a warehouse)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=snowflake_client.CONCURRENCY_MAX,
+        help="maximum number of scrape tasks (and Snowflake statements) at once,"
+        " the adaptive concurrency limit grows up to it",
+    )
+    parser.add_argument(
+        "--inventory",
+        help="persist every scraped object to this SQLite inventory",
+    )
+    parser.add_argument(
+        "--from_inventory",
+        help="render from this SQLite inventory instead of scraping Snowflake",
+    )
+    parser.add_argument(
+        "--render_workers",
+        type=int,
+        default=1,
+        help="with --from_inventory, render the output files in this many processes",
+    )
+    parser.add_argument(
+        "--profile",
+        nargs="?",
+        const="profile",
+        help="write per-phase CPU profiles and a trace file to this directory",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="skip the phases the last (crashed or failed) run into tf_dir finished",
+    )
     args = parser.parse_args()
+    if args.tables and args.metadata_only:
+        parser.error("--tables reads information_schema, so it needs a warehouse")
+    if args.render_workers > 1 and not args.from_inventory:
+        parser.error("--render_workers only applies to --from_inventory")
+    if args.resume and args.from_inventory:
+        parser.error("--resume only applies to scrapes, not --from_inventory")
+
+    if args.accounts:
+        with open(args.accounts) as f:
+            accounts = json.load(f)["accounts"]
+        print("note that each account is written to: ", os.path.abspath(args.tf_dir))
+        summaries = scrape_accounts(accounts, args)
+        for summary in summaries:
+            if "error" in summary:
+                print(f"{summary['account']}: FAILED {summary['error']}")
+                continue
+            counts = ", ".join(f"{v} {k}" for k, v in summary["resources"].items())
+            print(
+                f"{summary['account']}: {summary['seconds']:.0f}s, {counts}, "
+                f"{len(summary['compute_statements'])} statement(s) needed a warehouse"
+            )
+            for unit, error in summary["failed_units"].items():
+                print(f"{summary['account']}: {unit} FAILED {error}")
+        if any("error" in summary or summary["failed_units"] for summary in summaries):
+            raise SystemExit(1)
+        raise SystemExit(0)
+
     tf_dir = os.path.abspath(args.tf_dir)
     print("note that tf_dir is set to: ", tf_dir)
+    if args.synthesize_state and os.path.exists(os.path.join(tf_dir, STATE_FILENAME)):
+        parser.error(f"{STATE_FILENAME} already exists in {tf_dir}, move it first")
+
+    # The phases only need the terraform working dir. Run `terraform init` yourself.
+    t = types.SimpleNamespace(working_dir=tf_dir, import_dir=os.getcwd())
+    summary = run(t, args)
 
-    t = python_terraform.Terraform(working_dir=tf_dir)
-    # t.init()
+    compute_statements = summary["compute_statements"]
+    if compute_statements:
+        print(f"{len(compute_statements)} statement(s) needed a warehouse:")
+        for sql in compute_statements:
+            print("  ", sql)
+    else:
+        print("No statement needed a warehouse")
 
-    database_names = tf_databases(t)
-    tf_file_format(t, database_names)
-    database_schemas = tf_schemas(t, database_names)
-    tf_stages(t, database_names)
-    tf_warehouses(t)
-    tf_pipes(t, database_names)
+    failed_units = summary["failed_units"]
+    if failed_units:
+        print(f"{len(failed_units)} unit(s) failed, rerun with --resume to retry them:")
+        for unit, error in failed_units.items():
+            print("  ", unit, error)
+        raise SystemExit(1)
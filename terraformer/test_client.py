@@ -0,0 +1,143 @@
+import contextlib
+import re
+
+import pytest
+
+import client
+
+SHOW_COLUMNS = ["created_on", "name", "owner"]
+
+
+def show_rows(total):
+    return [(f"2024-01-{i:02d}", f"DB_{i:02d}", f"ROLE_{i % 3}") for i in range(total)]
+
+
+class FakeCursor:
+    """
+    answers `show databases [limit N [from 'NAME']]` from `rows` sorted by name, with
+    FROM including or excluding the start name, and RESULT_SCAN of the last SHOW
+    """
+
+    def __init__(self, con):
+        self.con = con
+        self.description = None
+        self.result = []
+        self.sfqid = None
+
+    def execute(self, sql):
+        self.con.statements.append(sql)
+        scan = re.match(r"select (.*) from table\(result_scan\('(\d+)'\)\)$", sql)
+        if scan:
+            columns = [col.strip('"') for col in scan.group(1).split(", ")]
+            show = self.con.results[int(scan.group(2))]
+            indexes = [SHOW_COLUMNS.index(col) for col in columns]
+            self.description = [(col.upper(),) for col in columns]
+            self.result = [tuple(row[i] for i in indexes) for row in show]
+            return
+        show = re.match(r"show databases(?: limit (\d+))?(?: from '(.*)')?$", sql)
+        rows = self.con.rows
+        if show.group(2) is not None:
+            if self.con.from_inclusive:
+                rows = [row for row in rows if row[1] >= show.group(2)]
+            else:
+                rows = [row for row in rows if row[1] > show.group(2)]
+        if show.group(1):
+            rows = rows[: int(show.group(1))]
+        self.description = [(col,) for col in SHOW_COLUMNS]
+        self.result = rows
+        self.sfqid = str(len(self.con.results))
+        self.con.results.append(rows)
+
+    def fetchall(self):
+        return list(self.result)
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, rows, from_inclusive):
+        self.rows = rows
+        self.from_inclusive = from_inclusive
+        self.statements = []
+        self.results = []
+
+    def cursor(self):
+        return FakeCursor(self)
+
+
+@pytest.fixture
+def connect(monkeypatch):
+    monkeypatch.setattr(client, "compute_statements", [])
+    monkeypatch.setattr(client, "METADATA_ONLY", False)
+
+    def connect(rows, from_inclusive=True):
+        con = FakeConnection(rows, from_inclusive)
+        monkeypatch.setattr(
+            client,
+            "get_snowflake_connection",
+            lambda **kwargs: contextlib.nullcontext(con),
+        )
+        return con
+
+    return connect
+
+
+@pytest.mark.parametrize("from_inclusive", [True, False])
+@pytest.mark.parametrize("total", [25, 20, 0])
+@pytest.mark.parametrize("prefetch", [True, False])
+def test_pages_yield_every_row_once(connect, from_inclusive, total, prefetch):
+    con = connect(show_rows(total), from_inclusive)
+
+    rows = list(
+        client.iter_show(
+            "show databases;", paginate=True, page_size=10, prefetch=prefetch
+        )
+    )
+
+    assert rows == show_rows(total)
+    pages = [sql for sql in con.statements if sql.startswith("show")]
+    assert pages[0] == "show databases limit 10"
+    assert all(sql.startswith("show databases limit 10 from 'DB_") for sql in pages[1:])
+
+
+def test_exact_multiple_of_page_size_stops_on_an_empty_page(connect):
+    con = connect(show_rows(20), from_inclusive=False)
+
+    assert (
+        len(list(client.iter_show("show databases", paginate=True, page_size=10))) == 20
+    )
+
+    assert con.statements == [
+        "show databases limit 10",
+        "show databases limit 10 from 'DB_09'",
+        "show databases limit 10 from 'DB_19'",
+    ]
+
+
+def test_without_paginate_runs_one_plain_show(connect):
+    con = connect(show_rows(25))
+
+    assert list(client.iter_show("show databases", page_size=10)) == show_rows(25)
+    assert con.statements == ["show databases"]
+
+
+@pytest.mark.parametrize("metadata_only", [False, True])
+@pytest.mark.parametrize("from_inclusive", [True, False])
+def test_projected_pages(connect, monkeypatch, metadata_only, from_inclusive):
+    monkeypatch.setattr(client, "METADATA_ONLY", metadata_only)
+    con = connect(show_rows(25), from_inclusive)
+
+    rows = list(
+        client.iter_show(
+            "show databases", columns=["owner", "kind"], paginate=True, page_size=10
+        )
+    )
+
+    # pages still move on by name, which wasn't asked for
+    assert rows == [{"owner": row[2], "kind": None} for row in show_rows(25)]
+    scans = [sql for sql in con.statements if "result_scan" in sql]
+    if metadata_only:
+        assert scans == []
+    else:
+        assert scans and all(sql.startswith('select "owner", "name" ') for sql in scans)
@@ -0,0 +1,135 @@
+import json
+import os
+import shutil
+import types
+
+import pytest
+
+import terraformer
+from journal import JOURNAL_FILENAME, Journal
+
+
+def stage(journal, unit, files):
+    staging_dir = journal.staging_dir(unit)
+    for filename, text in files.items():
+        with open(os.path.join(staging_dir, filename), "w") as f:
+            f.write(text)
+    return staging_dir
+
+
+def read(path):
+    with open(path) as f:
+        return f.read()
+
+
+def entries(tf_dir):
+    with open(os.path.join(tf_dir, JOURNAL_FILENAME)) as f:
+        return [json.loads(line) for line in f]
+
+
+def test_interrupted_commit_is_rolled_back(tmp_path, monkeypatch):
+    existing, new = tmp_path / "generated_tables.tf", tmp_path / "generated_new.tf"
+    existing.write_text("kept\n")
+    journal = Journal(str(tmp_path))
+    staging_dir = stage(
+        journal, "tf_tables:DB", {existing.name: "torn\n", new.name: "torn\n"}
+    )
+
+    def crash(src, dst):
+        dst.write(b"tor")
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(shutil, "copyfileobj", crash)
+    targets = {existing.name: str(existing), new.name: str(new)}
+    with pytest.raises(KeyboardInterrupt):
+        journal.commit("tf_tables:DB", staging_dir, targets)
+    monkeypatch.undo()
+
+    resumed = Journal(str(tmp_path), resume=True)
+
+    assert existing.read_text() == "kept\n"
+    assert not new.exists()
+    assert not resumed.is_done("tf_tables:DB")
+    assert entries(tmp_path)[-1] == {"unit": "tf_tables:DB", "status": "rolled_back"}
+
+
+def test_rollback_skips_missing_targets(tmp_path):
+    journal = Journal(str(tmp_path))
+    journal.record(
+        unit="tf_tables:DB",
+        status="committing",
+        sizes={str(tmp_path / "gone.tf"): 10, str(tmp_path / "new.tf"): None},
+    )
+
+    Journal(str(tmp_path), resume=True)
+
+    assert entries(tmp_path)[-1]["status"] == "rolled_back"
+
+
+def test_torn_last_line_is_cut(tmp_path):
+    journal = Journal(str(tmp_path))
+    journal.record(unit="tf_roles", status="done", result=["R"])
+    with open(journal.path, "a") as f:
+        f.write('{"unit": "tf_users", "sta')
+
+    resumed = Journal(str(tmp_path), resume=True)
+    resumed.record(unit="tf_users", status="failed", error="boom")
+
+    assert resumed.is_done("tf_roles")
+    assert resumed.result("tf_roles") == ["R"]
+    assert [entry["unit"] for entry in entries(tmp_path)] == ["tf_roles", "tf_users"]
+
+
+def test_resume_skips_done_units_and_reruns_failed_ones(tmp_path, monkeypatch):
+    import_dir = tmp_path / "imports"
+    import_dir.mkdir()
+    t = types.SimpleNamespace(working_dir=str(tmp_path), import_dir=str(import_dir))
+    calls = []
+
+    def scrape(fail):
+        def fn(unit_t, database):
+            calls.append((unit_t.unit, database))
+            with open(os.path.join(unit_t.working_dir, f"tf_{database}.tf"), "a") as f:
+                f.write(f"resource {database}\n")
+            with open(
+                os.path.join(unit_t.import_dir, terraformer.IMPORT_FILENAME), "a"
+            ) as f:
+                f.write(f"terraform import {database}\n")
+            if fail:
+                raise RuntimeError("flaky")
+            return [database]
+
+        return fn
+
+    monkeypatch.setattr(terraformer, "state_builder", None)
+    monkeypatch.setattr(terraformer, "inventory", None)
+    monkeypatch.setattr(terraformer, "journal", Journal(t.working_dir))
+    assert terraformer.run_unit(t, "tf_x:A", scrape(False), "A") == ["A"]
+    assert terraformer.run_unit(t, "tf_x:B", scrape(True), "B") is None
+
+    # resumed from another directory, the journal only has absolute paths
+    monkeypatch.chdir(import_dir)
+    calls.clear()
+    monkeypatch.setattr(terraformer, "journal", Journal(t.working_dir, resume=True))
+    assert terraformer.run_unit(t, "tf_x:A", scrape(False), "A") == ["A"]
+    assert terraformer.run_unit(t, "tf_x:B", scrape(False), "B") == ["B"]
+
+    assert calls == [("tf_x:B", "B")]
+    assert read(import_dir / terraformer.IMPORT_FILENAME) == (
+        "terraform import A\nterraform import B\n"
+    )
+    assert read(tmp_path / "tf_A.tf") == "resource A\n"
+    assert read(tmp_path / "tf_B.tf") == "resource B\n"
+
+
+def test_existing_json_target_is_refused(tmp_path):
+    target = tmp_path / "generated_pipes_db.tf.json"
+    target.write_text('{"resource": []}\n')
+    journal = Journal(str(tmp_path))
+    staging_dir = stage(journal, "tf_pipes:DB", {target.name: '{"resource": []}\n'})
+
+    with pytest.raises(FileExistsError):
+        journal.commit("tf_pipes:DB", staging_dir, {target.name: str(target)})
+
+    assert target.read_text() == '{"resource": []}\n'
+    assert not journal.is_done("tf_pipes:DB")
@@ -0,0 +1,78 @@
+import decimal
+
+import pytest
+import snowflake.connector.errors
+
+import rest_transport
+from sql_api_stub import SqlApiStub
+
+ROW_TYPE = [
+    {"name": "NAME", "type": "text"},
+    {"name": "ROWS", "type": "fixed", "scale": 0},
+    {"name": "SIZE_GB", "type": "fixed", "scale": 2},
+    {"name": "IS_TRANSIENT", "type": "boolean"},
+]
+DATA = [[f"T{i}", str(i), f"{i}.50", "false"] for i in range(5)]
+RESULTS = {
+    "show tables": {"rowType": ROW_TYPE, "data": DATA},
+    "select 1": {"rowType": [{"name": "1", "type": "fixed"}], "data": [["1"]]},
+    "select 2": {"rowType": [{"name": "2", "type": "fixed"}], "data": [["2"]]},
+}
+CONTEXT = {"database": "DB", "schema": None, "role": "SYSADMIN", "warehouse": None}
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    stub = SqlApiStub(RESULTS, polls=2, partition_size=2).start()
+    monkeypatch.setenv("SNOWFLAKE_SQL_API_URL", stub.url)
+    monkeypatch.setenv("SNOWFLAKE_OAUTH_TOKEN", "token")
+    monkeypatch.delenv("SNOWFLAKE_PRIVATE_KEY_PATH", raising=False)
+    monkeypatch.setattr(rest_transport, "POLL_INITIAL_SECONDS", 0.001)
+    yield stub
+    stub.stop()
+
+
+def test_polls_and_reads_every_partition(stub):
+    rows = rest_transport.execute("show tables", "xy12345", CONTEXT)
+
+    assert rows == [(f"T{i}", i, decimal.Decimal(f"{i}.50"), False) for i in range(5)]
+    paths = [path for _, path in stub.requests]
+    # submitted once, polled twice while running (202), then partitions 1 and 2
+    assert paths[0].startswith(rest_transport.STATEMENTS_PATH + "?")
+    assert sum("partition=" not in path for path in paths[1:]) == 2
+    partitions = [path.split("partition=")[1] for path in paths if "partition=" in path]
+    assert partitions == ["1", "2"]
+    assert len(stub.connections) == 1
+
+
+def test_multi_statement_rows_in_order(stub):
+    rows = rest_transport.execute("select 1; select 2;", "xy12345", CONTEXT, multi=True)
+
+    assert rows == [(1,), (2,)]
+
+
+def test_compilation_error_is_a_programming_error(stub):
+    with pytest.raises(snowflake.connector.errors.ProgrammingError) as e:
+        rest_transport.execute("select missing", "xy12345", CONTEXT)
+
+    assert e.value.errno == 2003
+    assert e.value.sqlstate == "02000"
+
+
+def test_socket_errors_become_retryable(stub, monkeypatch):
+    class TimingOutConnection:
+        def request(self, *args, **kwargs):
+            raise TimeoutError("timed out")
+
+        def close(self):
+            pass
+
+    monkeypatch.setattr(
+        rest_transport,
+        "connection",
+        lambda url: rest_transport.local.__dict__.setdefault(
+            "connections", {}
+        ).setdefault(url, TimingOutConnection()),
+    )
+    with pytest.raises(snowflake.connector.errors.InterfaceError):
+        rest_transport.execute("select 1", "xy12345", CONTEXT)
@@ -0,0 +1,118 @@
+import json
+import logging
+import os
+import re
+import uuid
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+STATE_FILENAME = "terraform.tfstate"
+
+# Matches main.tf, the state is written for the Snowflake-Labs/snowflake provider
+PROVIDER_ADDRESS = "registry.terraform.io/snowflake-labs/snowflake"
+TERRAFORM_VERSION = "1.2.3"
+STATE_VERSION = 4
+
+# Raw (non-HCL) attributes that are copied into the state when a resource has them.
+#   Everything else is filled in by the provider on `terraform plan -refresh-only`
+STATE_ATTRIBUTES = ["name", "database", "schema", "comment"]
+
+# alias_resource of resources declared with for_each, e.g. `role["SYSADMIN"]`
+INDEXED_ALIAS = re.compile(r'^(\w+)\["(.*)"\]$')
+
+
+def load_provider_schema(path: str) -> Dict[str, dict]:
+    """
+    loads the resource schemas from the output of `terraform providers schema -json`
+    returns a dict of {resource_type: {"version": int, "block": {...}}}
+    """
+    with open(path) as f:
+        schemas = json.load(f)["provider_schemas"]
+    for address, schema in schemas.items():
+        if address.lower() == PROVIDER_ADDRESS:
+            return schema.get("resource_schemas", {})
+    raise ValueError(f"{PROVIDER_ADDRESS} not found in provider schema {path}")
+
+
+class StateBuilder:
+    """
+    Collects scraped resources and writes them as a terraform.tfstate, so the state
+    can be built without running one `terraform import` per resource. Reconcile the
+    written state with a single `terraform plan -refresh-only` before anything else.
+    """
+
+    def __init__(self, provider_schema: Optional[Dict[str, dict]] = None):
+        self.provider_schema = provider_schema or {}
+        self.resources: List[dict] = []
+
+    def empty_attributes(self, resource_type: str) -> dict:
+        # Every attribute the provider knows about, so the state decodes cleanly
+        block = self.provider_schema.get(resource_type, {}).get("block", {})
+        attributes = {k: None for k in block.get("attributes", {})}
+        attributes.update({k: [] for k in block.get("block_types", {})})
+        return attributes
+
+    def add(self, resource) -> None:
+        if resource.excluded or not resource.state_importable:
+            return
+        resource_type = resource.snowflake_provider_resource
+        attributes = self.empty_attributes(resource_type)
+        attributes.update(
+            {
+                attr: getattr(resource, attr)
+                for attr in STATE_ATTRIBUTES
+                if getattr(resource, attr, None)
+            }
+        )
+        attributes["id"] = resource.identifier_resource
+        instance = {
+            "schema_version": self.provider_schema.get(resource_type, {}).get(
+                "version", 0
+            ),
+            "attributes": attributes,
+            "sensitive_attributes": [],
+        }
+        name = resource.alias_resource
+        indexed = INDEXED_ALIAS.match(name)
+        if indexed:
+            name = indexed.group(1)
+            instance["index_key"] = indexed.group(2)
+        self.resources.append(
+            {
+                "mode": "managed",
+                "type": resource_type,
+                "name": name,
+                "provider": f'provider["{PROVIDER_ADDRESS}"]',
+                "instances": [instance],
+            }
+        )
+
+    def state(self) -> dict:
+        # instances of the same for_each resource belong to one resource entry
+        merged: Dict[tuple, dict] = {}
+        for res in self.resources:
+            key = (res["type"], res["name"])
+            if key in merged:
+                merged[key]["instances"].extend(res["instances"])
+            else:
+                merged[key] = dict(res, instances=list(res["instances"]))
+        return {
+            "version": STATE_VERSION,
+            "terraform_version": TERRAFORM_VERSION,
+            "serial": 1,
+            "lineage": str(uuid.uuid4()),
+            "outputs": {},
+            "resources": list(merged.values()),
+        }
+
+    def write(self, file_dir=".", filename=STATE_FILENAME) -> str:
+        """
+        writes the state file. Like the rest of the generated files this never
+        overwrites anything, an existing state has to be moved out of the way first.
+        """
+        path = os.path.join(file_dir, filename)
+        with open(path, "x") as f:
+            json.dump(self.state(), f, indent=2)
+        logger.info(f"Wrote {len(self.resources)} resources to {path}")
+        return path